@@ -1,9 +1,35 @@
 import open3d as o3d
-import json
-from multiprocessing import Process, Queue, Lock, Array, Value
+import json, time, threading, heapq, traceback, numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process, Queue, Event, Array, Value
 import OctreeFormatTools as oft
 from FrustumManager import FrustumManager
 
+# mvp (model * view * projection matrix) shared by visualizer, the only writer, and traversal
+# the matrix is written in the buffer not in use and then published incrementing the sequence number,
+# so readers never wait for the writer: they only read again if the sequence number changed while reading
+class MvpChannel:
+
+    def __init__(self, wakeup):
+        self.buffers = Array('d', 32, lock=False)
+        self.seq = Value('L', 0, lock=False)
+        self.wakeup = wakeup
+
+    def publish(self, m):
+        b = (self.seq.value + 1) % 2 * 16
+        self.buffers[b:b + 16] = m
+        self.seq.value += 1
+        self.wakeup.set()
+
+    # return the sequence number and the values of the last published mvp, sequence number is 0 until the first mvp
+    def read(self):
+        while True:
+            seq = self.seq.value
+            b = seq % 2 * 16
+            m = self.buffers[b:b + 16]
+            if self.seq.value == seq:
+                return seq, m
+
 # preparing shared object
 torender = Queue()
 todelete = Queue()
@@ -11,129 +37,231 @@ toload = Queue()
 loaded = Queue()
 picked = Queue()
 cached = Queue()
-mvp = Array('d', range(16))
-mvp_sem = Value('i', 0)
-
-# mvp (model * vie * projection matrix) lock
-mvp_lock = Lock()
+# traversal sleeps until camera moves or a message arrives for it
+wakeup = Event()
+mvp = MvpChannel(wakeup)
 
 ####################### LOADER #######################
 
-def loader(octreedir):
-    nl = oft.NodeLoader(octreedir)
-    loaded.put(nl.load_root().points)
-    lru = oft.LRU()
+# nodes are copied once in the slots of the arena and only slot handles (oft.Slot) travel through the queues
+# loader is the only process that assigns and recycles slots: a slot is referenced by the node sent to traversal/visualizer
+# and by the cache, traversal and visualizer give back their reference through the cached queue
+# requests are served by a pool of io_workers threads, so reads overlap, and the children of every served node are
+# prefetched in cache while there are free slots. Threads wait on queues and conditions, so an idle loader doesn't use cpu
+def loader(octreedir, arena, cache_size, io_workers):
+    # return a free slot, removing nodes from cache or waiting for dropped nodes if arena is full (lock must be held)
+    def alloc():
+        index = arena.alloc()
+        while index is None:
+            if not lru.evict():
+                freed.wait()
+            index = arena.alloc()
+
+        return index
+
+    # node no longer used by traversal or visualizer, cache it or release its slot if it is already cached (lock must be held)
+    def drop(node):
+        if lru.exist(node.id):
+            arena.release(node.points.index)
+        else:
+            lru.store_node(node)
+
+    def receive_dropped():
+        while True:
+            node = cached.get()
+            with lock:
+                drop(node)
+                freed.notify_all()
+
+    # send the node to traversal, from cache or from disk
+    # if the node can't be read the error is printed and traversal receives the node without slot
+    def serve(id):
+        # the node could be still in prefetching
+        with lock:
+            pending = prefetching.get(id)
+        if pending is not None:
+            pending.result()
+
+        with lock:
+            slot = lru.get_node_points(id)
+            if slot is not None:
+                arena.acquire(slot.index)
+            else:
+                index = alloc()
 
-    while True:
-        if not toload.empty():
-            id = toload.get()
+        if slot is None:
+            try:
+                slot = oft.Slot(index, nl.load_into(id, arena.get_buffer(index)))
+            except Exception:
+                print("Node " + id + " not loaded")
+                traceback.print_exc()
+                with lock:
+                    arena.release(index)
+                    freed.notify_all()
+
+        loaded.put((id, slot))
+        wakeup.set()
+        for child in children[id]:
+            prefetch(child)
+
+    # speculative load of a node in cache, only if a slot is free
+    def prefetch(id):
+        with lock:
+            if lru.exist(id) or id in prefetching:
+                return
+
+            index = arena.alloc()
+            if index is not None:
+                prefetching[id] = prefetch_pool.submit(fetch, id, index)
+
+    # a node that can't be read is not cached, the error is printed when the node is requested
+    def fetch(id, index):
+        try:
+            slot = oft.Slot(index, nl.load_into(id, arena.get_buffer(index)))
+        except Exception:
+            slot = None
 
-            if lru.exist(id):
-                loaded.put(lru.extract_node_points(id))
+        with lock:
+            if slot is not None:
+                lru.store_node(oft.VisNode(id, slot))
             else:
-                loaded.put(nl.load_node_full_addr(id).points)
+                arena.release(index)
+            del prefetching[id]
+            freed.notify_all()
 
-        if not cached.empty():
-            lru.store_node(cached.get())
+    nl = oft.NodeLoader(octreedir)
+    lru = oft.LRU(maxbytes=cache_size, on_evict=lambda id, slot: arena.release(slot.index))
+    lock = threading.Lock()
+    freed = threading.Condition(lock)
+    prefetching = {}
+    pool = ThreadPoolExecutor(max_workers=io_workers)
+    # prefetches have their own threads, they never wait for slots and must not queue behind requests waiting for them
+    prefetch_pool = ThreadPoolExecutor(max_workers=max(1, io_workers // 2))
+
+    # ids of the children of every node
+    children = {}
+    nodes = [oft.gen_hierarchy(octreedir)]
+    for n in nodes:
+        children[n.id] = [c.id for c in n.links]
+        nodes.extend(n.links)
+
+    with lock:
+        index = alloc()
+    loaded.put(('r', oft.Slot(index, nl.load_into('r', arena.get_buffer(index)))))
+    wakeup.set()
+
+    threading.Thread(target=receive_dropped, daemon=True).start()
+    while True:
+        pool.submit(serve, toload.get())
 
 ####################### TRAVERSAL #######################
 
-def traversal(octreedir, mvp, mvp_sem, max_nodes):
-    def load(id):
-        toload.put(id)
-        in_loading.append(id)
-        activate(id, visroot)
+# nodes closer than this to the near plane have the priority of nodes at this distance
+MIN_DIST = 1e-6
+# queues are flushed by a background thread, so a wakeup can arrive before its message: traversal checks again after this time
+WAKEUP_TIMEOUT = 0.1
+
+# the LOD engine renders the nodes with max priority while they fit in a budget of points (and optionally of bytes)
+# max_nodes is a hard limit on the number of rendered nodes, given by the slots of the arena
+def traversal(octreedir, mvp, max_points, max_bytes, max_nodes):
+    # nodes are identified by their integer handle in hierarchy, ids are used only to communicate with other processes
+    def load(h):
+        toload.put(hierarchy.ids[h])
+        in_loading.add(h)
+        hierarchy.activate(h)
 
     def add(node):
         torender.put(node)
 
-    def remove(node):
-        todelete.put(node.id)
+    # a node still in loading was never sent to visualizer, it is discarded when it arrives
+    def remove(h):
+        if h not in in_loading:
+            todelete.put(hierarchy.ids[h])
 
-    def remove_branch(r, rendered_nodes):
+    def remove_branch(r):
         remove(r)
-        r.deactivate()
-        rendered_nodes -= 1
-        for i in range(len(r.links)):
-            if r.links[i].active:
-                rendered_nodes = remove_branch(r.links[i], rendered_nodes)
-
-        return rendered_nodes
-
-    def get_visnode(id, r):
-        for i in range(len(r.links)):
-            if r.links[i].id == id[:len(r.links[i].id)]:
-                if len(id) == len(r.links[i].id):
-                    return r.links[i]
+        hierarchy.deactivate(r)
+        for n in hierarchy.children(r):
+            if hierarchy.active[n]:
+                remove_branch(n)
+
+    # check if a node fits in the budget, given number, points and bytes of rendered nodes
+    def fits(h, nodes, points, size):
+        return nodes < max_nodes and points + hierarchy.pointsnum[h] <= max_points and (max_bytes is None or size + hierarchy.size[h] <= max_bytes)
+
+    # only partially visible nodes can have children to load and only subtrees with active nodes can have nodes to remove
+    # the subtree of a node totally out (or into) frustum is totally out (or into) too and has no nodes to load
+    def visited(h):
+        return visibility[h] == 1 or hierarchy.active_below[h] > 0
+
+    # visibility and distance from near plane of the nodes visited by manage_hierarchy, level by level from the root
+    # children of partially visible nodes are classified in a single call for each level, the others inherit the visibility of their parent
+    def cull():
+        visibility[0], dist[0] = (a[0] for a in fm.bboxes_in_frustum(bounds.bounds[:1]))
+        level = [0]
+
+        while len(level) > 0:
+            tocull = []
+            for r in level:
+                children = hierarchy.children(r)
+                if visibility[r] == 1:
+                    tocull.extend(children)
                 else:
-                    return get_visnode(id, r.links[i])
+                    visibility[children.start:children.stop] = visibility[r]
 
-        return None
+            if len(tocull) > 0:
+                visibility[tocull], dist[tocull] = fm.bboxes_in_frustum(bounds.bounds[tocull])
 
-    def activate(id, r):
-        for i in range(len(r.links)):
-            if r.links[i].id == id[:len(r.links[i].id)]:
-                if len(id) == len(r.links[i].id):
-                    r.links[i].activate()
-                else:
-                    activate(id, r.links[i])
+            level = [n for r in level for n in hierarchy.children(r) if visited(n)]
+
+    # screen space error of a node: its bounding radius projected at its distance from the near plane
+    # totally visible nodes weigh more than partially visible ones
+    def priority(h):
+        return bounds.radius[h] * visibility[h] / max(dist[h], MIN_DIST)
 
     # add or remove nodes to the torender queue. According to frustum values and LOD engine
-    def manage_hierarchy(rendered_nodes):
-        ids_to_evaluate = []
-        bb_to_evaluate = []
-        bb_visibility = []
+    def manage_hierarchy():
+        # max heap of the nodes to load, as (-priority, handle)
+        candidates = []
 
-        # function for file ids_to_evaluate list with candidate nodes
-        def modify_nodes(r, rendered_nodes):
-            v = 0
+        cull()
+
+        # function for fill candidates heap with candidate nodes
+        def modify_nodes(r):
+            children = hierarchy.children(r)
 
             # calculate how many bb are completely visible
-            for n in r.links:
-                if fm.bbox_in_frustum(bbman.id_to_bb(n.id)) == 2:
-                    v += 1
-
-            for n in r.links:
-                bb = bbman.id_to_bb(n.id)
-                visible = fm.bbox_in_frustum(bb)
-                dist = fm.dist_from_near(bb.get_midx(), bb.get_midy(), bb.get_midz())
-
-                if visible > 0 and (v <= 0.4 * len(r.links) or dist <= bb.get_radius()) and v != len(r.links) and not n.active:
-                    ids_to_evaluate.append(n.id)
-                    bb_to_evaluate.append(bb)
-                    bb_visibility.append(visible)
-                elif n.active and visible == 0:
-                    remove(n)
-                    n.deactivate()
-                    rendered_nodes -= 1
-                elif n.active and v == len(r.links):
-                    rendered_nodes = remove_branch(n, rendered_nodes)
+            v = np.count_nonzero(visibility[children.start:children.stop] == 2)
 
-                rendered_nodes = modify_nodes(n, rendered_nodes)
+            for n in children:
+                visible = visibility[n]
 
-            return rendered_nodes
+                if visible > 0 and (v <= 0.4 * len(children) or dist[n] <= bounds.radius[n]) and v != len(children) and not hierarchy.active[n]:
+                    heapq.heappush(candidates, (-priority(n), n))
+                elif hierarchy.active[n] and visible == 0:
+                    remove(n)
+                    hierarchy.deactivate(n)
+                elif hierarchy.active[n] and v == len(children):
+                    remove_branch(n)
 
-        rendered_nodes = modify_nodes(visroot, rendered_nodes)
+                if visited(n):
+                    modify_nodes(n)
 
-        # iterate over all nodes to evaluate, get the nodes that has max priority (radius * visibility * (1/distf_from_near)), extract and load this node
-        # TODO bisognerebbe verificare se ci sono nodi attivi che hanno una priorità minore di nodi da caricare
-        # TODO se questo avviene e la soglia di nodi blocca il caricamento, è necessario rimuovere i nodi con meno priorità ed aggiungere quelli con priorità maggiore
-        while len(ids_to_evaluate) > 0 and rendered_nodes<max_nodes:
-            priority = -1
-            tl = 0
+        modify_nodes(0)
 
-            for i in range(len(ids_to_evaluate)):
-                if (bb_to_evaluate[i].get_radius() * bb_visibility[i] * (1 / fm.dist_from_near(bb_to_evaluate[i].get_midx(), bb_to_evaluate[i].get_midy(), bb_to_evaluate[i].get_midz()))) > priority:
-                    priority = bb_to_evaluate[i].get_radius() * bb_visibility[i]
-                    tl = i
+        # rendered nodes that can be swapped out, every active node is visited by cull, so its priority is up to date
+        evictables = oft.Evictables(hierarchy, priority, in_loading)
 
-            id = ids_to_evaluate.pop(tl)
-            load(id)
-            bb_to_evaluate.pop(tl)
-            bb_visibility.pop(tl)
-            rendered_nodes += 1
+        # load the nodes with max priority that fit in the budget, swapping out the rendered nodes with lower priority
+        # a node that doesn't fit is skipped, smaller nodes with lower priority can still fit
+        while len(candidates) > 0:
+            p, h = heapq.heappop(candidates)
 
-        return rendered_nodes
+            evicted = evictables.make_room(h, -p, lambda nodes, points, size: fits(h, nodes, points, size))
+            if evicted is not None:
+                for e in evicted:
+                    remove(e)
+                load(h)
 
     ###################################################
     # load cloud info from json file
@@ -148,40 +276,59 @@ def traversal(octreedir, mvp, mvp_sem, max_nodes):
             classes = json.load(classfile)
 
     # waiting the load of root node and then add it to the visualizer
-    while loaded.empty():
-        pass
-    visroot = oft.VisNode('r', loaded.get())
-    add(visroot)
+    add(oft.VisNode('r', loaded.get()[1]))
     # populate the hierarchy
-    visroot.links = oft.gen_hierarchy(octreedir).links
-    visroot.activate()
+    hierarchy = oft.Hierarchy(oft.gen_hierarchy(octreedir))
+    hierarchy.activate(0)
+
+    # bounding boxes of all nodes, computed once and indexed by handle
+    bounds = oft.NodeBounds(bbman, hierarchy.ids)
+    # results of culling, updated only for the visited nodes
+    visibility = np.zeros(len(hierarchy), dtype=int)
+    dist = np.zeros(len(hierarchy))
 
     fm = FrustumManager()
-    in_loading = []
-    rendered_nodes = 1
+    in_loading = set()
 
-    # waiting until mvp (model * view * projection, matrix) values are loaded
-    while mvp_sem.value == 0:
-        pass
+    # waiting until mvp (model * view * projection, matrix) values are published
+    while mvp.read()[0] == 0:
+        wakeup.wait(WAKEUP_TIMEOUT)
+
+    old_seq = 0
+    # a new rendered node can have children to load even if camera didn't move
+    changed = True
 
     while True :
-        # update frustum values
-        mvp_lock.acquire()
-        try:
-            fm.update_frustum(mvp)
-        finally:
-            mvp_lock.release()
-
-        # arrange nodes according to the values of frustum
-        rendered_nodes = manage_hierarchy(rendered_nodes)
-
-        # add to visualizer one loaded node, only if is still active
-        if not loaded.empty():
-            vn = get_visnode(in_loading.pop(0), visroot)
-            if vn.active == True:
-                add(oft.VisNode(vn.id, loaded.get()))
+        # arrange nodes according to the values of frustum, nothing changes if camera didn't move and no node was rendered
+        seq, m = mvp.read()
+        if changed or seq != old_seq:
+            fm.update_frustum(m)
+            manage_hierarchy()
+            old_seq = seq
+            changed = False
+
+        # sleep until something happens, messages sent before clear are read below
+        else:
+            wakeup.wait(WAKEUP_TIMEOUT)
+            wakeup.clear()
+
+        # add to visualizer the loaded nodes, only if are still active and it's the first arrival of the node
+        # a node removed and requested again while in loading arrives twice
+        while not loaded.empty():
+            id, slot = loaded.get()
+            h = hierarchy.get_handle(id)
+            # the node was not loaded because of an error, it can be requested again
+            if slot is None:
+                in_loading.discard(h)
+                hierarchy.deactivate(h)
+            elif h in in_loading and hierarchy.active[h]:
+                in_loading.discard(h)
+                add(oft.VisNode(id, slot))
+                changed = True
             else:
-                loaded.get()
+                in_loading.discard(h)
+                # give back the slot to loader
+                cached.put(oft.VisNode(id, slot))
 
         # check if classifications are found
         if classes is not None:
@@ -194,104 +341,117 @@ def traversal(octreedir, mvp, mvp_sem, max_nodes):
 
 ####################### VISUALIZER #######################
 
-def visualizer(octreedir, mvp, mvp_sem):
-    # removing point clouds from nodes and return if there was a change or not
-    def remove_geometry():
-        if not todelete.empty():
-            id = todelete.get()
-            try:
-                index = onrenderid.index(id)
-                cached.put(onrender.pop(index))
-                vis.remove_geometry(onrenderid.pop(index))
-            except:
-                pass
+# budget of every frame for adding nodes to the render: seconds and points, at least one node is added
+FRAME_TIME = 0.02
+FRAME_POINTS = 500 * 1000
+
+def visualizer(octreedir, arena, mvp):
+    # removing point clouds from nodes
+    # traversal sends the removal of a node only after its add, but the two queues can be read out of order:
+    # a removal of a node not yet added is kept and the node is discarded when it arrives
+    def remove_geometry(id):
+        if id in onrender:
+            cached.put(onrender.pop(id))
+            vis.remove_geometry(id)
+        else:
+            removed[id] = removed.get(id, 0) + 1
+
+    # coordinates, colours and classes of node points, quantized points are converted here just before passing them to Open3D
+    def get_xyz(node):
+        if isinstance(node.points, oft.QuantizedPoints):
+            return node.points.get_xyz(bbman.id_to_bb(node.id), precision)
+        return node.points[:, :3]
+
+    def get_rgb(node):
+        if isinstance(node.points, oft.QuantizedPoints):
+            return node.points.get_rgb()
+        return node.points[:, 3:6]
+
+    def get_classes(node):
+        if isinstance(node.points, oft.QuantizedPoints):
+            return node.points.get_classes()
+        return node.points[:, -1:]
+
+    # Open3D copies contiguous arrays of the right type in bulk, other arrays are converted element by element
+    def to_vector3d(array):
+        return o3d.utility.Vector3dVector(np.ascontiguousarray(array, dtype=np.float64))
+
+    def to_int_vector(array):
+        return o3d.utility.IntVector(np.ascontiguousarray(array, dtype=np.int32).ravel())
 
     def create_xyz_pcd(node):
         pcd = o3d.geometry.PointCloud()
         pcd.id = node.id
-        pcd.points = o3d.utility.Vector3dVector(node.points[:, :3])
+        pcd.points = to_vector3d(get_xyz(node))
         return pcd
 
     def create_xyzrgb_pcd(node):
         pcd = o3d.geometry.PointCloud()
         pcd.id = node.id
-        pcd.points = o3d.utility.Vector3dVector(node.points[:, :3])
-        pcd.colors = o3d.utility.Vector3dVector(node.points[:, 3:6])
+        pcd.points = to_vector3d(get_xyz(node))
+        pcd.colors = to_vector3d(get_rgb(node))
         return pcd
 
     def create_xyzc_pcd(node):
         pcd = o3d.geometry.PointCloud()
         pcd.id = node.id
-        pcd.points = o3d.utility.Vector3dVector(node.points[:, :3])
-        pcd.classes = node.data[:, 3:4]
-
-        c = []
-        for i in node.points[:, 3:4]:
-            c.append(i)
-
-        pcd.classes = o3d.utility.IntVector(c)
+        pcd.points = to_vector3d(get_xyz(node))
+        pcd.classes = to_int_vector(get_classes(node))
         return pcd
 
     def create_xyzrgbc_pcd(node):
         pcd = o3d.geometry.PointCloud()
         pcd.id = node.id
-        pcd.points = o3d.utility.Vector3dVector(node.points[:, :3])
-        pcd.colors = o3d.utility.Vector3dVector(node.points[:, 3:6])
-
-        c = []
-        for i in node.points[:, 6:7]:
-            c.append(i)
-
-        pcd.classes = o3d.utility.IntVector(c)
+        pcd.points = to_vector3d(get_xyz(node))
+        pcd.colors = to_vector3d(get_rgb(node))
+        pcd.classes = to_int_vector(get_classes(node))
         return pcd
 
-    # adding point clouds from nodes and return if there was a change or not
+    # adding point clouds from nodes and return the number of added points
     def add_geometry():
-        updated = not torender.empty()
+        if torender.empty():
+            return 0
 
-        if updated:
-            node = torender.get()
-            onrenderid.append(node.id)
-            onrender.append(node)
-            vis.add_geometry(create_pcd(node))
+        node = torender.get()
+        if removed.get(node.id, 0) > 0:
+            removed[node.id] -= 1
+            cached.put(node)
+            return 0
 
-        return updated
+        onrender[node.id] = node
+        # the points are views of the arena slot, Open3D copies them
+        pcd = create_pcd(oft.VisNode(node.id, arena.read(node.points).points))
+        vis.add_geometry(pcd)
+        return len(pcd.points)
 
-    # update model view projection matrix that is used for frustum culling
-    def update_mvp():
-        param = ctr.get_mvp_matrix()
-        for i in (range(param.shape[0])):
-            for j in (range(param.shape[1])):
-                mvp[i * 4 + j] = param[i][j]
+    # add the loaded nodes while the budget of the frame is not spent, then remove all the nodes to delete
+    def update_geometries():
+        start = time.perf_counter()
+        points = 0
 
-    def on_geometry_update(vis):
-        modify_geometry = True
-        old_mvp = []
+        while points < FRAME_POINTS and time.perf_counter() - start < FRAME_TIME and not torender.empty():
+            points += add_geometry()
 
-        # get the old mvp value
-        for i in range(len(mvp)):
-            old_mvp.append(mvp[i])
+        while not todelete.empty():
+            remove_geometry(todelete.get())
 
-        # update m*v*p matrix values
-        mvp_lock.acquire()
-        try:
-            update_mvp()
-        finally:
-            mvp_lock.release()
+    # publish model view projection matrix that is used for frustum culling, only if camera moved. Return if it moved
+    def update_mvp():
+        m = np.asarray(ctr.get_mvp_matrix()).ravel().tolist()
+        if m == mvp.read()[1]:
+            return False
 
-        for i in range(len(old_mvp)):
-            if old_mvp[i] != mvp[i]:
-                modify_geometry = False
-                break
+        mvp.publish(m)
+        return True
 
+    def on_geometry_update(vis):
         # add or remove geometry to cloud only if there was no interaction with point cloud
-        if modify_geometry:
-            updated = add_geometry()
-            if not updated:
-                remove_geometry()
+        if not update_mvp():
+            update_geometries()
 
     def on_point_picked(id):
         picked.put(id)
+        wakeup.set()
 
     def on_reset(vis):
         vis.reset_view_point(True)
@@ -299,7 +459,11 @@ def visualizer(octreedir, mvp, mvp_sem):
     ###################################################
     # load cloud info from json file
     with open(octreedir + "cloud.json", "r") as infofile:
-        fstruct = json.load(infofile)['structure']
+        info = json.load(infofile)
+        fstruct = info['structure']
+        # precision of quantized nodes
+        precision = info.get('precision')
+        bbman = oft.BBManager(oft.BoundingBox(info['minx'], info['miny'], info['minz'], info['maxx'], info['maxy'], info['maxz']))
 
     vis = o3d.visualization.VisualizerWithKeyCallback()
 
@@ -319,33 +483,33 @@ def visualizer(octreedir, mvp, mvp_sem):
     vis.register_key_callback(ord("R"), on_reset)
     vis.register_animation_callback(on_geometry_update)
     vis.create_window()
-    onrender = []
-    onrenderid = []
+    # rendered nodes by id and number of removals received before the add of the node
+    onrender = {}
+    removed = {}
     ctr = vis.get_view_control()
 
     # waiting until the first geometry is added
-    mvp_lock.acquire()
-    try:
-        while add_geometry() == False:
-            vis.update_geometry()
-            vis.poll_events()
-            vis.update_renderer()
-    finally:
-        mvp_lock.release()
+    while add_geometry() == 0:
+        vis.update_geometry()
+        vis.poll_events()
+        vis.update_renderer()
 
     vis.update_geometry()
     vis.poll_events()
     vis.update_renderer()
     update_mvp()
-    mvp_sem.value = 1
     vis.run()
     vis.destroy_window()
 
-def start(octreeDir, max_nodes = 40):
+# cache_size: bytes of points kept in the loader cache, io_workers: number of nodes read at the same time
+def start(octreeDir, max_points = 4 * 1000 * 1000, max_bytes = None, max_nodes = 100, cache_size = 512 * 1024 * 1024, io_workers = 4):
+    # shared memory for nodes: rendered or in transit nodes, cached nodes and the root
+    slotsize = oft.NodeLoader(octreeDir).get_max_node_size()
+    arena = oft.NodeArena(max_nodes + 2 + cache_size // slotsize, slotsize)
     # preparing processes
-    loa = Process(target=loader, args=(octreeDir,))
-    vis = Process(target=visualizer, args=(octreeDir, mvp, mvp_sem,))
-    tra = Process(target=traversal, args=(octreeDir, mvp, mvp_sem, max_nodes,))
+    loa = Process(target=loader, args=(octreeDir, arena, cache_size, io_workers,))
+    vis = Process(target=visualizer, args=(octreeDir, arena, mvp,))
+    tra = Process(target=traversal, args=(octreeDir, mvp, max_points, max_bytes, max_nodes,))
     # starting processes
     loa.start()
     vis.start()
@@ -357,5 +521,4 @@ def start(octreeDir, max_nodes = 40):
     tra.terminate()
     loa.join()
     tra.join()
-
-
+    arena.close()
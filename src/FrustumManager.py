@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 # implemenation from:
 # https://cgvr.cs.uni-bremen.de/teaching/cg_literatur/lighthouse3d_view_frustum_culling/index.html
@@ -18,6 +19,9 @@ class FrustumManager:
         for i in range(6):
             self.pl.append(Plane())
 
+        # coefficients of the 6 planes, one row (a, b, c, d) for each plane
+        self.planes = np.zeros((6, 4))
+
     # m: projection matrix * model matrix * view matrix
     def update_frustum(self, m):
         self.pl[self.NEARP].set_coeff(
@@ -51,6 +55,9 @@ class FrustumManager:
             -m[2] + m[14],
             -m[3] + m[15])
 
+        for i in range(6):
+            self.planes[i] = [self.pl[i].a, self.pl[i].b, self.pl[i].c, self.pl[i].d]
+
     def dist_from_near(self, x, y, z):
         return self.pl[self.NEARP].distance(x, y, z)
 
@@ -64,31 +71,64 @@ class FrustumManager:
     # 0 bbox is totally out of frustum
     # 1 bbox is partially into frustum
     # 2 bbox is totally into frustum
-    def bbox_in_frustum(self, bb):
-        points = []
-        in_frustum = 0
-
-        points.append([bb.minx, bb.miny, bb.minz])
-        points.append([bb.maxx, bb.miny, bb.minz])
-        points.append([bb.minx, bb.maxy, bb.minz])
-        points.append([bb.minx, bb.miny, bb.maxz])
-        points.append([bb.maxx, bb.maxy, bb.minz])
-        points.append([bb.minx, bb.maxy, bb.maxz])
-        points.append([bb.maxx, bb.miny, bb.maxz])
-        points.append([bb.maxx, bb.maxy, bb.maxz])
-
-        points.append([bb.get_midx(), bb.get_midy(), bb.get_midz()])
-
-        for i in range(len(points)):
-            if self.point_in_frustum(points[i][0], points[i][1], points[i][2]):
-                in_frustum += 1
-
-        if in_frustum == 0:
-            return 0
-        elif in_frustum < len(points):
-            return 1
+    # for every plane only two corners are tested: the positive vertex (the farthest one along the plane normal) and
+    # the negative vertex (the nearest one). With sphere the bounding sphere of the box is tested before them
+    def bbox_in_frustum(self, bb, sphere = False):
+        if sphere:
+            r = bb.get_bounding_radius()
+            inside = True
+
+            for p in self.pl:
+                d = p.a * bb.get_midx() + p.b * bb.get_midy() + p.c * bb.get_midz() + p.d
+                if d < -r:
+                    return 0
+                elif d <= r:
+                    inside = False
+
+            if inside:
+                return 2
+
+        ret = 2
+        for p in self.pl:
+            # positive vertex
+            if not p.is_point_infront(bb.maxx if p.a >= 0 else bb.minx, bb.maxy if p.b >= 0 else bb.miny, bb.maxz if p.c >= 0 else bb.minz):
+                return 0
+            # negative vertex
+            if not p.is_point_infront(bb.minx if p.a >= 0 else bb.maxx, bb.miny if p.b >= 0 else bb.maxy, bb.minz if p.c >= 0 else bb.maxz):
+                ret = 1
+
+        return ret
+
+    # batch version of bbox_in_frustum and dist_from_near for many bounding boxes, in a single numpy pass
+    # bounds: array (N, 6) with a row (minx, miny, minz, maxx, maxy, maxz) for each bounding box
+    # returns the array of visibility values (0, 1, 2) and the array of distances of box centers from near plane
+    def bboxes_in_frustum(self, bounds, sphere = False):
+        mins = bounds[:, :3]
+        maxs = bounds[:, 3:]
+        extents = (maxs - mins) / 2
+        centers = mins + extents
+
+        # signed distance of box centers from planes, shape (N, 6)
+        cdist = centers @ self.planes[:, :3].T + self.planes[:, 3]
+        dist = np.abs(cdist[:, self.NEARP]) / np.linalg.norm(self.planes[self.NEARP, :3])
+
+        # distance of positive and negative vertices from the center, along the plane normal
+        if sphere:
+            visibility = np.ones(bounds.shape[0], dtype=int)
+            r = np.linalg.norm(extents, axis=1)[:, np.newaxis]
+            visibility[(cdist < -r).any(axis=1)] = 0
+            visibility[(cdist > r).all(axis=1)] = 2
+
+            undecided = np.flatnonzero(visibility == 1)
+            cdist = cdist[undecided]
+            vdist = extents[undecided] @ np.abs(self.planes[:, :3]).T
         else:
-            return 2
+            undecided = slice(None)
+            vdist = extents @ np.abs(self.planes[:, :3]).T
+            visibility = np.empty(bounds.shape[0], dtype=int)
+
+        visibility[undecided] = np.where((cdist + vdist <= 0).any(axis=1), 0, np.where((cdist - vdist <= 0).any(axis=1), 1, 2))
+        return visibility, dist
 
 # Plane equation: Ax + By + Cz + D = 0
 class Plane:
@@ -15,10 +15,16 @@ def main(argv):
         if os.path.isdir(argv[1]):
             octreeDir = argv[1]
         else:
-            if len(argv) == 3 and argv[2] != "none":
+            # structure of binary files is read from the file itself, text files are xyz by default
+            if len(argv) >= 3 and argv[2] != "none":
                 structure = argv[2]
             else:
-                structure = "xyz"
+                structure = oft.file_structure(argv[1]) or "xyz"
+
+            if len(argv) >= 4:
+                workers = int(argv[3])
+            else:
+                workers = 1
 
             if "c" in structure:
                 classes = {
@@ -36,18 +42,19 @@ def main(argv):
                         12: "sedia",
                     }
 
-                gen = oft.Generator(argv[1], structure, classes)
+                gen = oft.Generator(argv[1], structure, classes, workers=workers)
             else:
-                gen = oft.Generator(argv[1], structure)
+                gen = oft.Generator(argv[1], structure, workers=workers)
 
             octreeDir = gen.parse()
 
-        CloudInterpreter.start(octreeDir, 80)
+        CloudInterpreter.start(octreeDir, 4000000)
 
     else:
-        print("Usage: python3 INPUT STRUCTURE")
-        print("INPUT=path to octree hierarchy or file to convert")
-        print("STRUCTURE=structure of file to convert")
+        print("Usage: python3 INPUT STRUCTURE WORKERS")
+        print("INPUT=path to octree hierarchy or file to convert (text, .las, .ply or .npy)")
+        print("STRUCTURE=structure of file to convert (optional for binary files)")
+        print("WORKERS=number of processes used by the converter (optional, default 1)")
 
 if __name__ == "__main__":
    main(sys.argv)
\ No newline at end of file
@@ -1,5 +1,7 @@
-import os, time, pickle, json, random, numpy as np
+import os, time, math, pickle, json, random, struct, mmap, shutil, heapq, queue, numpy as np
 from enum import Enum
+from collections import OrderedDict, deque
+from multiprocessing import Process, Queue
 
 # FUNCTIONS
 
@@ -37,14 +39,389 @@ def id_to_node(id):
 
     return path + id[len(id) - 1] + ".bin"
 
+# binary node format (little-endian):
+# header: magic, version, links byte (child mask), number of attributes, number of points
+# attribute: name, numpy type, number of components
+# followed by one array (points x components) for each attribute, every array starts at a multiple of 8 bytes
+NODE_MAGIC = b'OCTN'
+NODE_VERSION = 1
+NODE_HEADER = struct.Struct('<4sBBHQ')
+NODE_ATTRIBUTE = struct.Struct('<8s2sB5x')
+# structure of the points stored as a single float64 attribute, according to their number of components
+FLOAT_STRUCTURES = {3: "xyz", 4: "xyzc", 6: "xyzrgb", 7: "xyzrgbc"}
+
+# return the size in bytes of the points of a node (float64 array or QuantizedPoints)
+def points_size(points):
+    return getattr(points, 'nbytes', 0)
+
+# return the size of an attribute array, padded to a multiple of 8 bytes
+def padded_size(size):
+    return (size + 7) // 8 * 8
+
+# write node to file in binary node format
+def write_node(f, node):
+    if isinstance(node.points, QuantizedPoints):
+        attributes = [("xyz", node.points.xyz), ("rgb", node.points.rgb), ("c", node.points.c)]
+        attributes = [(name, array) for name, array in attributes if array is not None]
+    else:
+        points = np.ascontiguousarray(node.points, dtype='<f8')
+        attributes = [(FLOAT_STRUCTURES[points.shape[1]], points)]
+
+    f.write(NODE_HEADER.pack(NODE_MAGIC, NODE_VERSION, int.from_bytes(node.links, byteorder='big'), len(attributes), node.points.shape[0]))
+    for name, array in attributes:
+        f.write(NODE_ATTRIBUTE.pack(name.encode(), array.dtype.str[1:].encode(), array.shape[1]))
+    for name, array in attributes:
+        f.write(array.data)
+        f.write(bytes(padded_size(array.nbytes) - array.nbytes))
+
+# read node from a buffer in binary node format, arrays are views of the buffer (no copies)
+# buffers that don't start with the magic number are read as pickled nodes, the format of old octrees
+def read_node(buffer):
+    if bytes(buffer[:len(NODE_MAGIC)]) != NODE_MAGIC:
+        return pickle.loads(buffer)
+
+    magic, version, links, attributesnum, pointsnum = NODE_HEADER.unpack_from(buffer, 0)
+    if version != NODE_VERSION:
+        raise Exception('Node format version ' + str(version) + ' not supported')
+
+    offset = NODE_HEADER.size + attributesnum * NODE_ATTRIBUTE.size
+    attributes = {}
+    for i in range(attributesnum):
+        name, dtype, components = NODE_ATTRIBUTE.unpack_from(buffer, NODE_HEADER.size + i * NODE_ATTRIBUTE.size)
+        dtype = np.dtype('<' + dtype.decode())
+        array = np.frombuffer(buffer, dtype, pointsnum * components, offset)
+        attributes[name.rstrip(b'\x00').decode()] = array.reshape((pointsnum, components))
+        offset += padded_size(array.nbytes)
+
+    links = links.to_bytes(1, byteorder='big')
+    if 'xyz' in attributes and attributes['xyz'].dtype.kind == 'i':
+        return Node(QuantizedPoints(attributes['xyz'], attributes.get('rgb'), attributes.get('c')), links)
+    return Node(next(iter(attributes.values())), links)
+
+# select the columns of values (one row for each point) with the given structure (see FileTypes) in a float64 array
+# the intensity column is skipped and colours are scaled to [0, 1], so rows are x, y, z, [r, g, b], [c] as in the points of nodes
+def select_columns(values, structure):
+    points = values[:, [i for i in range(len(structure)) if structure[i] != 'i']].astype(np.float64, copy=False)
+    if "rgb" in structure:
+        points[:, 3:6] /= 255.0
+    return points
+
+# parse a block of whole text lines of a point cloud file with the given structure, see select_columns
+# lines can have more columns than the structure, the extra ones are ignored
+# a block is parsed at once if all its values are read and they are as many as the lines by the columns of the first line,
+# otherwise (lines with different columns, blank lines or values that aren't numbers) it is parsed line by line
+def parse_points(text, structure):
+    values = np.fromstring(text, sep=' ')
+    columnsnum = len(text.split('\n', 1)[0].split())
+    linesnum = text.count('\n') + (0 if text.endswith('\n') else 1)
+    if columnsnum >= len(structure) and values.size == linesnum * columnsnum:
+        return select_columns(values.reshape((-1, columnsnum)), structure)
+
+    return select_columns(parse_lines(text, structure), structure)
+
+# parse a block of text lines one at a time, keeping only the columns of the structure, blank lines are skipped
+# raise an exception with the first line that doesn't match the structure
+def parse_lines(text, structure):
+    rows = []
+    for line in text.split('\n'):
+        values = line.split()
+        if len(values) == 0:
+            continue
+
+        try:
+            if len(values) < len(structure):
+                raise ValueError()
+            rows.append([float(v) for v in values[:len(structure)]])
+        except ValueError:
+            raise Exception('Line does not match the structure ' + structure + ': ' + line)
+
+    return np.array(rows, dtype=np.float64).reshape((-1, len(structure)))
+
+# BINARY INPUT FORMATS
+# readers of binary point clouds, every reader maps the file in memory and returns the points with the given structure
+# (see FileTypes, intensity is ignored) as float64 arrays of about chunksize bytes of the file, like parse_points
+
+# names of the fields of colours and classes in binary formats with named fields (PLY, structured npy)
+RGB_FIELDS = ("red", "green", "blue")
+CLASS_FIELDS = ("classification", "class", "label")
+
+# return the name of the class field of records, None if there is none
+def class_field(names):
+    for name in CLASS_FIELDS:
+        if name in names:
+            return name
+    return None
+
+# return the structure of the points that a file in binary format can give, None for text files
+def file_structure(addr):
+    ext = os.path.splitext(addr)[1].lower()
+    if ext == ".las":
+        return "xyzrgbc" if las_header(addr)['format'] in LAS_RGB_OFFSETS else "xyzc"
+    if ext == ".ply":
+        names = ply_vertex(addr)[0].names
+    elif ext == ".npy":
+        array = np.load(addr, mmap_mode='r')
+        if array.dtype.names is None:
+            return FLOAT_STRUCTURES.get(array.shape[1])
+        names = array.dtype.names
+    else:
+        return None
+
+    ret = "xyz"
+    if all(name in names for name in RGB_FIELDS):
+        ret += "rgb"
+    if class_field(names) is not None:
+        ret += "c"
+    return ret
+
+# convert records with named fields (x, y, z, red, green, blue, classification) in points with the given structure
+# colours are divided by rgbscale
+def fields_to_points(records, structure, rgbscale):
+    columns = [records['x'], records['y'], records['z']]
+    if "rgb" in structure:
+        columns.extend([records[name] / rgbscale for name in RGB_FIELDS])
+    if "c" in structure:
+        columns.append(records[class_field(records.dtype.names)])
+    return np.column_stack(columns).astype(np.float64, copy=False)
+
+# check that records with named fields have the attributes of structure
+def check_fields(names, structure, addr):
+    if not all(name in names for name in ('x', 'y', 'z')):
+        raise Exception('Coordinates not found in ' + addr)
+    if "rgb" in structure and not all(name in names for name in RGB_FIELDS):
+        raise Exception('Colours not found in ' + addr)
+    if "c" in structure and class_field(names) is None:
+        raise Exception('Classes not found in ' + addr)
+
+# scale of colours stored as integers: full range of their type, 8 bit colours in 16 bit fields are found by their max value
+def rgb_scale(records, chunkpoints):
+    dtype = records.dtype[RGB_FIELDS[0]]
+    if dtype.kind == 'f':
+        return 1.0
+    if dtype.itemsize == 1:
+        return 255.0
+
+    rgbmax = 0
+    for start in range(0, records.shape[0], chunkpoints):
+        chunk = records[start:start + chunkpoints]
+        rgbmax = max([rgbmax] + [int(chunk[name].max()) for name in RGB_FIELDS])
+    return 255.0 if rgbmax <= 255 else 65535.0
+
+# LAS 1.2 - 1.4, uncompressed point data record formats 0 - 10
+LAS_SIGNATURE = b'LASF'
+# offset of colours in point data records, for the formats that have them
+LAS_RGB_OFFSETS = {2: 20, 3: 28, 5: 28, 7: 30, 8: 30, 10: 30}
+
+def las_header(addr):
+    with open(addr, 'rb') as f:
+        header = f.read(375)
+
+    if header[:4] != LAS_SIGNATURE:
+        raise Exception('Not a LAS file: ' + addr)
+
+    minor = header[25]
+    size, offset = struct.unpack_from('<HI', header, 94)
+    format, length, pointsnum = struct.unpack_from('<BHI', header, 104)
+    if minor >= 4 and size >= 255:
+        pointsnum = struct.unpack_from('<Q', header, 247)[0] or pointsnum
+    if format & 0xC0 != 0:
+        raise Exception('Compressed LAS (LAZ) not supported: ' + addr)
+    if format > 10:
+        raise Exception('LAS point data record format ' + str(format) + ' not supported')
+
+    return {
+        "format": format,
+        "offset": offset,
+        "length": length,
+        "pointsnum": pointsnum,
+        "scale": struct.unpack_from('<3d', header, 131),
+        "origin": struct.unpack_from('<3d', header, 155)
+    }
+
+def read_las(addr, structure, chunksize):
+    header = las_header(addr)
+    format = header['format']
+    if "rgb" in structure and format not in LAS_RGB_OFFSETS:
+        raise Exception('Colours not found in ' + addr)
+
+    names = ['x', 'y', 'z', 'classification']
+    formats = ['<i4', '<i4', '<i4', 'u1']
+    offsets = [0, 4, 8, 15 if format < 6 else 16]
+    if format in LAS_RGB_OFFSETS:
+        names.extend(RGB_FIELDS)
+        formats.extend(['<u2'] * 3)
+        offsets.extend([LAS_RGB_OFFSETS[format] + 2 * i for i in range(3)])
+
+    dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': header['length']})
+    records = np.memmap(addr, dtype, 'r', header['offset'], (header['pointsnum'],))
+    chunkpoints = max(1, chunksize // header['length'])
+    rgbscale = rgb_scale(records, chunkpoints) if "rgb" in structure else None
+
+    for start in range(0, records.shape[0], chunkpoints):
+        chunk = records[start:start + chunkpoints]
+        points = np.empty((chunk.shape[0], 7 if "rgb" in structure else 4))
+        for i in range(3):
+            points[:, i] = chunk[names[i]] * header['scale'][i] + header['origin'][i]
+        if "rgb" in structure:
+            for i in range(3):
+                points[:, 3 + i] = chunk[RGB_FIELDS[i]] / rgbscale
+        # classification is 5 bits in the formats before 6, the others are flags
+        points[:, -1] = chunk['classification'] & 0x1F if format < 6 else chunk['classification']
+
+        yield points if "c" in structure else points[:, :-1]
+
+# binary PLY, little or big endian: points are the vertex element, elements before it can't have list properties
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8"
+}
+
+# return dtype, number and byte offset of the vertices of a PLY file
+def ply_vertex(addr):
+    elements = []
+
+    with open(addr, 'rb') as f:
+        if f.readline().strip() != b'ply':
+            raise Exception('Not a PLY file: ' + addr)
+
+        line = f.readline().split()
+        while line != [b'end_header']:
+            if len(line) == 0:
+                raise Exception('PLY header without end_header: ' + addr)
+            if line[0] == b'format':
+                if line[1] == b'binary_little_endian':
+                    order = '<'
+                elif line[1] == b'binary_big_endian':
+                    order = '>'
+                else:
+                    raise Exception('Only binary PLY files are supported: ' + addr)
+            elif line[0] == b'element':
+                elements.append((line[1].decode(), int(line[2]), []))
+            elif line[0] == b'property':
+                elements[-1][2].append(line[1:])
+            line = f.readline().split()
+
+        offset = f.tell()
+
+    for name, count, properties in elements:
+        if any(p[0] == b'list' for p in properties):
+            raise Exception('PLY list properties before vertices not supported: ' + addr)
+
+        dtype = np.dtype([(p[1].decode(), order + PLY_TYPES[p[0].decode()]) for p in properties])
+        if name == "vertex":
+            return dtype, count, offset
+        offset += count * dtype.itemsize
+
+    raise Exception('PLY file without vertices: ' + addr)
+
+def read_ply(addr, structure, chunksize):
+    dtype, count, offset = ply_vertex(addr)
+    check_fields(dtype.names, structure, addr)
+
+    records = np.memmap(addr, dtype, 'r', offset, (count,))
+    chunkpoints = max(1, chunksize // dtype.itemsize)
+    rgbscale = rgb_scale(records, chunkpoints) if "rgb" in structure else None
+
+    for start in range(0, count, chunkpoints):
+        yield fields_to_points(records[start:start + chunkpoints], structure, rgbscale)
+
+# numpy array of points: rows with the columns of structure (as lines of a text file) or records with named fields (as PLY)
+def read_npy(addr, structure, chunksize):
+    array = np.load(addr, mmap_mode='r')
+    chunkpoints = max(1, chunksize // array.dtype.itemsize)
+
+    if array.dtype.names is not None:
+        check_fields(array.dtype.names, structure, addr)
+        rgbscale = rgb_scale(array, chunkpoints) if "rgb" in structure else None
+        for start in range(0, array.shape[0], chunkpoints):
+            yield fields_to_points(array[start:start + chunkpoints], structure, rgbscale)
+    else:
+        if array.ndim != 2 or array.shape[1] < len(structure):
+            raise Exception('Array does not match the structure ' + structure + ': ' + addr)
+        chunkpoints = max(1, chunkpoints // array.shape[1])
+        for start in range(0, array.shape[0], chunkpoints):
+            yield select_columns(array[start:start + chunkpoints], structure)
+
+# readers of binary formats by file extension, the other files are read as text
+POINT_READERS = {".las": read_las, ".ply": read_ply, ".npy": read_npy}
+
+# quantize float64 points (rows x, y, z, [r, g, b], [c]) of a node with bounding box bb
+# coordinates become offsets from the minimum of bb in units of precision, colours uint8 and classes uint8 or uint16
+def quantize(points, bb, precision):
+    xyz = np.rint((points[:, :3] - [bb.minx, bb.miny, bb.minz]) / precision)
+    if xyz.size > 0 and xyz.max() > np.iinfo(np.int32).max:
+        raise Exception('Precision ' + str(precision) + ' too small for the bounding box of the cloud')
+
+    rgb = None
+    c = None
+    if points.shape[1] >= 6:
+        rgb = np.rint(points[:, 3:6] * 255.0).astype('u1')
+    if points.shape[1] == 4 or points.shape[1] == 7:
+        c = np.rint(points[:, -1:])
+        c = c.astype('<u2') if c.size > 0 and c.max() > 255 else c.astype('u1')
+
+    return QuantizedPoints(xyz.astype('<i4'), rgb, c)
+
+# return links byte (as int) and number of points of a node, reading only the header from a buffer in binary node format
+def read_node_header(buffer):
+    magic, version, links, attributesnum, pointsnum = NODE_HEADER.unpack_from(buffer, 0)
+    if magic != NODE_MAGIC or version != NODE_VERSION:
+        raise Exception('Not a node in binary node format version ' + str(NODE_VERSION))
+    return links, pointsnum
+
+# hierarchy index: header (magic, version, length of ids, number of nodes) followed by one record for each node in breadth-first order
+# record: id, links byte (child mask), number of points, byte offset and size of the node in its file
+HIERARCHY_FILE = "hierarchy.bin"
+HIERARCHY_MAGIC = b'OCTH'
+HIERARCHY_VERSION = 1
+HIERARCHY_HEADER = struct.Struct('<4sBHQ')
+
+def hierarchy_dtype(idlen):
+    return np.dtype([('id', 'S' + str(idlen)), ('links', 'u1'), ('pointsnum', '<u8'), ('offset', '<u8'), ('size', '<u8')])
+
+# write hierarchy index, records: list of tuples (id, links, pointsnum, offset, size)
+def write_hierarchy(addr, records):
+    idlen = max(len(r[0]) for r in records)
+    index = np.array([(r[0].encode(),) + tuple(r[1:]) for r in records], dtype=hierarchy_dtype(idlen))
+
+    with open(addr, 'wb') as f:
+        f.write(HIERARCHY_HEADER.pack(HIERARCHY_MAGIC, HIERARCHY_VERSION, idlen, index.shape[0]))
+        f.write(index.data)
+
+# read hierarchy index as a numpy structured array
+def read_hierarchy(addr):
+    with open(addr, 'rb') as f:
+        magic, version, idlen, nodesnum = HIERARCHY_HEADER.unpack(f.read(HIERARCHY_HEADER.size))
+        if magic != HIERARCHY_MAGIC or version != HIERARCHY_VERSION:
+            raise Exception('Hierarchy index version not supported')
+        return np.fromfile(f, hierarchy_dtype(idlen), nodesnum)
+
+# packed octree: all nodes in a single file, at the offsets written in the hierarchy index
+ARCHIVE_FILE = "octree.dat"
+
+# build the VisNode tree of an octree, from the hierarchy index if present otherwise loading all nodes
 def gen_hierarchy(octreeDir):
     def populate(root, id):
         ret = VisNode(id)
+        ret.pointsnum = root.points.shape[0]
+        ret.size = points_size(root.points)
         for i in range(ord('a'), ord('a') + 8):
             if node_exist(chr(i), int.from_bytes(root.links, byteorder='big')):
                 ret.links.append(populate(nl.load_node_full_addr(id + chr(i)), id + chr(i)))
         return ret
 
+    if os.path.exists(octreeDir + HIERARCHY_FILE):
+        nodes = {}
+        for record in read_hierarchy(octreeDir + HIERARCHY_FILE):
+            id = record['id'].decode()
+            nodes[id] = VisNode(id)
+            nodes[id].pointsnum = int(record['pointsnum'])
+            nodes[id].size = int(record['size'])
+            if len(id) > 1:
+                nodes[id[:-1]].links.append(nodes[id])
+        return nodes['r']
 
     nl = NodeLoader(octreeDir)
     return populate(nl.load_root(), 'r')
@@ -68,6 +445,8 @@ class VisNode:
         self.links = []
         self.active = False
         self.points = points
+        self.pointsnum = 0
+        self.size = 0
 
     def activate(self):
         self.active = True
@@ -81,7 +460,7 @@ class Node:
     def __init__(self, points, links = b'\x00'):
         self.links = links
 
-        if type(points[0]) is Point:
+        if not isinstance(points, QuantizedPoints) and type(points[0]) is Point:
             pointsnum = len(points)
 
             def push_point(i):
@@ -115,28 +494,169 @@ class Node:
         else:
             self.points = points
 
+# points of a node stored in compact form, see quantize
+# coordinates and colours are converted back to float64 only when they are needed (for example by Open3D)
+class QuantizedPoints:
+
+    def __init__(self, xyz, rgb = None, c = None):
+        self.xyz = xyz
+        self.rgb = rgb
+        self.c = c
+
+    # shape of the float64 points
+    @property
+    def shape(self):
+        dim = 3
+        if self.rgb is not None:
+            dim += 3
+        if self.c is not None:
+            dim += 1
+        return (self.xyz.shape[0], dim)
+
+    @property
+    def nbytes(self):
+        ret = self.xyz.nbytes
+        if self.rgb is not None:
+            ret += self.rgb.nbytes
+        if self.c is not None:
+            ret += self.c.nbytes
+        return ret
+
+    # bb: bounding box of the node, precision: the one used by quantize
+    def get_xyz(self, bb, precision):
+        ret = self.xyz * precision
+        ret += [bb.minx, bb.miny, bb.minz]
+        return ret
+
+    def get_rgb(self):
+        return self.rgb / 255.0
+
+    def get_classes(self):
+        return self.c
+
+    def dequantize(self, bb, precision):
+        columns = [self.get_xyz(bb, precision)]
+        if self.rgb is not None:
+            columns.append(self.get_rgb())
+        if self.c is not None:
+            columns.append(self.c)
+        return np.hstack(columns)
+
+# load nodes from the directory hierarchy of an octree or, if present, from its packed archive (see ARCHIVE_FILE)
 class NodeLoader:
     def __init__(self, dir):
         self.dir = dir
+        self.archive = None
+
+        if os.path.exists(dir + ARCHIVE_FILE):
+            self.index = {}
+            for record in read_hierarchy(dir + HIERARCHY_FILE):
+                self.index[record['id'].decode()] = (int(record['offset']), int(record['size']))
+
+            with open(dir + ARCHIVE_FILE, 'rb') as a:
+                self.archive = mmap.mmap(a.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.archive)
 
     def load_node(self, id):
-        with open(self.dir + "r/" + id_to_node(id), 'rb') as r:
-            return pickle.load(r)
+        return self.__load("r" + id)
 
     def load_node_full_addr(self, id):
-        with open(self.dir + id_to_node(id), 'rb') as r:
-            return pickle.load(r)
+        return self.__load(id)
 
     def load_ghost_node(self, id):
         try:
-            with open(self.dir + "r/" + id_to_node(id), 'rb') as r:
-                return pickle.load(r)
+            return self.__load("r" + id)
         except:
             return None
 
     def load_root(self):
-        with open(self.dir + "r.bin", 'rb') as r:
-            return pickle.load(r)
+        return self.__load("r")
+
+    # copy the bytes of the node (full id) in buffer, without decoding them, and return their number
+    def load_into(self, id, buffer):
+        if self.archive is not None:
+            offset, size = self.index[id]
+            buffer[:size] = self.view[offset:offset + size]
+            return size
+
+        with open(self.dir + id_to_node(id), 'rb') as r:
+            return r.readinto(buffer)
+
+    # return the size in bytes of the biggest node
+    def get_max_node_size(self):
+        if os.path.exists(self.dir + HIERARCHY_FILE):
+            return int(read_hierarchy(self.dir + HIERARCHY_FILE)['size'].max())
+
+        ret = os.path.getsize(self.dir + "r.bin")
+        for path, dirs, names in os.walk(self.dir + "r"):
+            for name in names:
+                ret = max(ret, os.path.getsize(os.path.join(path, name)))
+        return ret
+
+    # id: full id of the node
+    def __load(self, id):
+        if self.archive is not None:
+            offset, size = self.index[id]
+            return read_node(self.view[offset:offset + size])
+
+        # read the whole file in a writable buffer, the points of the node are a view of it
+        with open(self.dir + id_to_node(id), 'rb') as r:
+            buffer = bytearray(os.fstat(r.fileno()).st_size)
+            r.readinto(buffer)
+        return read_node(buffer)
+
+# handle of a node stored in a NodeArena, it is what travels through the queues instead of the points
+class Slot:
+
+    def __init__(self, index, size):
+        self.index = index
+        self.size = size
+
+    # bytes of the node kept in the arena, used by LRU
+    @property
+    def nbytes(self):
+        return self.size
+
+# shared memory divided in slots of the same size, each one holds the bytes of a node (binary node format)
+# the memory is an anonymous shared mapping, so it is shared with the processes started (forked) after the arena is created
+# the loader copies a node once in a slot and the other processes read it as views of the shared memory
+# slots are reference counted and recycled only by the process that assigns them, the others must give them back
+class NodeArena:
+
+    def __init__(self, slotsnum, slotsize):
+        self.slotsize = padded_size(slotsize)
+        self.mm = mmap.mmap(-1, slotsnum * self.slotsize)
+        self.buf = memoryview(self.mm)
+        self.refs = [0] * slotsnum
+        self.free = deque(range(slotsnum))
+
+    # return the index of a free slot referenced once, None if all slots are in use
+    def alloc(self):
+        if len(self.free) == 0:
+            return None
+
+        index = self.free.popleft()
+        self.refs[index] = 1
+        return index
+
+    def acquire(self, index):
+        self.refs[index] += 1
+
+    def release(self, index):
+        self.refs[index] -= 1
+        if self.refs[index] == 0:
+            self.free.append(index)
+
+    def get_buffer(self, index):
+        return self.buf[index * self.slotsize:(index + 1) * self.slotsize]
+
+    # return the node in slot, its points are views of the shared memory
+    def read(self, slot):
+        return read_node(self.get_buffer(slot.index)[:slot.size])
+
+    def close(self):
+        self.buf.release()
+        self.mm.close()
 
 class Point:
 
@@ -171,6 +691,13 @@ class BoundingBox:
     def get_radius(self):
         return (((self.maxx - self.minx) + (self.maxy - self.miny) + (self.maxz - self.minz)) / 3)/2
 
+    # radius of the sphere that contains the box (half diagonal)
+    def get_bounding_radius(self):
+        return math.sqrt((self.maxx - self.minx) ** 2 + (self.maxy - self.miny) ** 2 + (self.maxz - self.minz) ** 2) / 2
+
+    def get_bounds(self):
+        return (self.minx, self.miny, self.minz, self.maxx, self.maxy, self.maxz)
+
 # manager of id and bounding box
 class BBManager:
 
@@ -233,6 +760,168 @@ class BBManager:
 
         return xcond and ycond and zcond
 
+    # return for every point (row of points) the index 0-7 of the child of bbox that contains it, a for 0 and h for 7
+    # points must be into bbox: lower halves are open on the midpoint, as in is_into
+    def child_index(self, bbox, points):
+        ret = (points[:, 0] >= bbox.get_midx()).astype(np.uint8)
+        ret |= (points[:, 1] >= bbox.get_midy()).astype(np.uint8) << 1
+        ret |= (points[:, 2] >= bbox.get_midz()).astype(np.uint8) << 2
+        return ret
+
+# bounding boxes of octree nodes computed once and stored in arrays indexed by integer node handles
+# handle of a node is the position of its id in the list given to the constructor
+class NodeBounds:
+
+    # ids: node ids, a parent must precede its children (for example breadth-first order)
+    def __init__(self, bbmanager, ids):
+        self.handles = {}
+        # one row (minx, miny, minz, maxx, maxy, maxz) for each node
+        self.bounds = np.empty((len(ids), 6))
+
+        for h in range(len(ids)):
+            id = ids[h]
+            parent = self.handles.get(id[:-1])
+            self.handles[id] = h
+
+            if parent is None:
+                self.bounds[h] = bbmanager.id_to_bb(id).get_bounds()
+            else:
+                pmin = self.bounds[parent, :3]
+                pmax = self.bounds[parent, 3:]
+                mid = ((pmax - pmin) / 2) + pmin
+                octant = ord(id[-1]) - ord('a')
+                high = [octant & 1 != 0, octant & 2 != 0, octant & 4 != 0]
+                self.bounds[h, :3] = np.where(high, mid, pmin)
+                self.bounds[h, 3:] = np.where(high, pmax, mid)
+
+        extents = self.bounds[:, 3:] - self.bounds[:, :3]
+        self.mids = (extents / 2) + self.bounds[:, :3]
+        self.radius = ((extents[:, 0] + extents[:, 1] + extents[:, 2]) / 3) / 2
+
+    def get_handle(self, id):
+        return self.handles[id]
+
+    def get_bounding_box(self, handle):
+        return BoundingBox(*self.bounds[handle])
+
+# hierarchy of an octree as flat arrays indexed by integer node handles, built from the VisNode tree of gen_hierarchy
+# nodes are in breadth-first order (the root has handle 0), so the children of a node have contiguous handles
+class Hierarchy:
+
+    def __init__(self, visroot):
+        nodes = [visroot]
+        for n in nodes:
+            nodes.extend(n.links)
+
+        self.ids = [n.id for n in nodes]
+        self.handles = {}
+        self.parent = np.full(len(nodes), -1, dtype=np.int32)
+        self.first_child = np.zeros(len(nodes), dtype=np.int32)
+        self.children_num = np.zeros(len(nodes), dtype=np.uint8)
+        self.pointsnum = np.array([n.pointsnum for n in nodes], dtype=np.int64)
+        self.size = np.array([n.size for n in nodes], dtype=np.int64)
+        self.active = np.zeros(len(nodes), dtype=bool)
+        # number of active nodes in the subtree of every node (node excluded)
+        self.active_below = np.zeros(len(nodes), dtype=np.int32)
+        # number, points and bytes of all active nodes
+        self.active_num = 0
+        self.active_points = 0
+        self.active_size = 0
+
+        next = 1
+        for h in range(len(nodes)):
+            self.handles[self.ids[h]] = h
+            self.first_child[h] = next
+            self.children_num[h] = len(nodes[h].links)
+            self.parent[next:next + len(nodes[h].links)] = h
+            next += len(nodes[h].links)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_handle(self, id):
+        return self.handles[id]
+
+    def get_id(self, handle):
+        return self.ids[handle]
+
+    def activate(self, handle):
+        if not self.active[handle]:
+            self.active[handle] = True
+            self.__update_active(handle, 1)
+
+    def deactivate(self, handle):
+        if self.active[handle]:
+            self.active[handle] = False
+            self.__update_active(handle, -1)
+
+    def __update_active(self, handle, value):
+        self.active_num += value
+        self.active_points += value * int(self.pointsnum[handle])
+        self.active_size += value * int(self.size[handle])
+        handle = self.parent[handle]
+        while handle >= 0:
+            self.active_below[handle] += value
+            handle = self.parent[handle]
+
+    # handles of the children of a node
+    def children(self, handle):
+        return range(self.first_child[handle], self.first_child[handle] + self.children_num[handle])
+
+    # handles of a node and of all its descendants
+    def subtree(self, handle):
+        ret = [handle]
+        for h in ret:
+            ret.extend(self.children(h))
+        return ret
+
+# min heap of the rendered nodes that can be swapped out, as (priority, handle)
+# only active nodes without active descendants can be removed without opening holes in the cloud
+class Evictables:
+
+    # priority: function of a handle, pinned: handles of nodes that can't be removed (e.g. still in loading)
+    def __init__(self, hierarchy, priority, pinned = ()):
+        self.hierarchy = hierarchy
+        self.priority = priority
+        self.pinned = pinned
+        self.heap = [(priority(h), h) for h in np.flatnonzero(hierarchy.active) if self.evictable(h)]
+        heapq.heapify(self.heap)
+
+    def evictable(self, handle):
+        return self.hierarchy.active[handle] and self.hierarchy.active_below[handle] == 0 and handle != 0 and handle not in self.pinned
+
+    # deactivate the rendered nodes with lower priority than p until fits(nodes, points, size) is true for the active ones
+    # return the handles of the deactivated nodes, or None (and nothing is deactivated) if room can't be made
+    def make_room(self, handle, p, fits):
+        h = self.hierarchy
+        nodes, points, size = h.active_num, h.active_points, h.active_size
+        chosen = []
+
+        while not fits(nodes, points, size):
+            while len(self.heap) > 0 and not self.evictable(self.heap[0][1]):
+                heapq.heappop(self.heap)
+
+            # the node with min priority is the parent of the node to load, or has at least its priority
+            if len(self.heap) == 0 or self.heap[0][1] == h.parent[handle] or self.heap[0][0] >= p:
+                for e in chosen:
+                    heapq.heappush(self.heap, e)
+                return None
+
+            chosen.append(heapq.heappop(self.heap))
+            e = chosen[-1][1]
+            nodes -= 1
+            points -= h.pointsnum[e]
+            size -= h.size[e]
+
+        for _, e in chosen:
+            h.deactivate(e)
+
+            # parent of the evicted node can become a leaf of the rendered nodes
+            if self.evictable(h.parent[e]):
+                heapq.heappush(self.heap, (self.priority(h.parent[e]), h.parent[e]))
+
+        return [e for _, e in chosen]
+
 class IdGenerator:
 
     def __init__(self, limit):
@@ -285,53 +974,107 @@ class IdGenerator:
         for i in range(self.c + 1):
             self.ids[i] = ord('a')
 
+# spatially uniform sampling of the points of a node, as the nested grid of Potree: the bounding box of the node is divided
+# in cells and every occupied cell gives one point, the closest to its center, so sampled points are at least about
+# one cell apart. Points can be added in more chunks, their positions are counted from the first point added
+class GridSampler:
+
+    def __init__(self, bb, cells):
+        self.mins = np.array([bb.minx, bb.miny, bb.minz])
+        size = (np.array([bb.maxx, bb.maxy, bb.maxz]) - self.mins) / cells
+        self.size = np.where(size > 0, size, 1.0)
+        self.cells = cells
+        self.count = 0
+        # cell, distance from the center of the cell and position of the chosen point of every occupied cell
+        self.ids = np.empty(0, dtype=np.int64)
+        self.dist = np.empty(0)
+        self.positions = np.empty(0, dtype=np.int64)
+
+    def add(self, points):
+        if points.shape[0] == 0:
+            return
+
+        c = np.clip(((points[:, :3] - self.mins) / self.size).astype(np.int64), 0, self.cells - 1)
+        dist = np.sum((points[:, :3] - (self.mins + (c + 0.5) * self.size)) ** 2, axis=1)
+        ids = (c[:, 0] * self.cells + c[:, 1]) * self.cells + c[:, 2]
+        positions = np.arange(self.count, self.count + points.shape[0])
+        self.count += points.shape[0]
+
+        # for every cell the closest point, the first one if more points have the same distance
+        ids = np.concatenate([self.ids, ids])
+        dist = np.concatenate([self.dist, dist])
+        positions = np.concatenate([self.positions, positions])
+        order = np.lexsort((positions, dist, ids))
+        first = np.concatenate([[True], ids[order][1:] != ids[order][:-1]])
+
+        self.ids = ids[order][first]
+        self.dist = dist[order][first]
+        self.positions = positions[order][first]
+
+    # positions of the chosen points, if they are more than limit a random subset of them
+    # if the occupied cells are less than a line of cells the points are (nearly) coincident and a random subset of all points
+    # is returned: the children would keep almost all points and the octree would be as deep as their number
+    def sample(self, rng, limit):
+        if len(self.positions) < self.cells:
+            return rng.sample(range(self.count), min(limit, self.count))
+        if len(self.positions) <= limit:
+            return self.positions
+        return self.positions[rng.sample(range(len(self.positions)), limit)]
+
 class Generator:
     #TODO rgb float gia' in file
 
-    # adreess of file, structure of file, classes, float rgb value
-    def __init__(self, fileaddr, type, classes = None, maxpn = 80000, frgb = False):
+    # adreess of file, structure of file, classes, float rgb value, bytes of text read for each chunk,
+    # number of processes that generate the sublevels, seed of the sampling (same seed gives same octree with any number of workers),
+    # precision of the coordinates of quantized nodes (None to store float64 points), pack all nodes in a single file,
+    # bytes of points held in memory while reading the file and splitting a node (None to load whole nodes, see __gen_sublevel_spilled),
+    # points that a node keeps from its children: "random" or "grid" (see GridSampler)
+    def __init__(self, fileaddr, type, classes = None, maxpn = 80000, frgb = False, chunksize = 32 * 1024 * 1024, workers = 1, seed = None, precision = None, packed = False, maxram = None, sampler = "random"):
         self.fileaddr = fileaddr
         self.type = type
         self.cloudname = fileaddr.split("/")[len(fileaddr.split("/")) - 1]
         self.dir = fileaddr.split(".")[0] + "Octree/"
         self.MAXPOINTSN = maxpn
         self.ROOTPOINTSN = 20000
+        # cells for each axis of the sampling grid of a node, a child is sampled with half of them (same spacing)
+        self.GRIDSIZE = 128
+        self.CHUNKSIZE = chunksize
+        self.WORKERS = workers
+        self.seed = seed
+        self.precision = precision
+        self.packed = packed
+        self.maxram = maxram
+        self.sampler = sampler
         self.classes = classes
+        # number of float64 values of every point
+        self.dims = 3 + (3 if "rgb" in type else 0) + (1 if "c" in type else 0)
 
     def parse(self):
         print("Octree-format generator started")
         start = time.time()
 
-        if self.type in FileTypes.XYZ.value:
-            self.create_point = self.__xyz_point
-        elif self.type in FileTypes.XYZRGB.value:
-            self.create_point = self.__xyzrgb_point
-        elif self.type in FileTypes.XYZIRGB.value:
-            self.create_point = self.__xyzirgb_point
-        elif self.type in FileTypes.XYZC.value:
-            self.create_point = self.__xyzc_point
-        elif self.type in FileTypes.XYZRGBC.value:
-            self.create_point = self.__xyzrgbc_point
-        elif self.type in FileTypes.XYZIRGBC.value:
-            self.create_point = self.__xyzirgbc_point
-        else:
+        if self.type not in [t.value for t in FileTypes]:
             raise Exception('File structure not supported, known structures are: xyz, xyzrgb, xyzirgb, xyzrgbc, xyzirgbc')
+        if self.sampler not in ["random", "grid"]:
+            raise Exception('Sampler not supported, known samplers are: random, grid')
 
         os.mkdir(self.dir)
         os.mkdir(self.dir + "r")
+        # nodes appended to the segments of the archive, see __append_node
+        self.records = []
 
-        with open(self.fileaddr, "r") as f:
-            self.__beginning(f)
-            self.__calc_bb_and_numpoints(f)
-            self.__beginning(f)
+        self.__calc_bb_and_numpoints()
 
         # create first level (root node is zero level)
-        # TODO un giorno (s1 = Process(target=self.__store_nodes, args=('a', 4, self.dir + "/r/", create_point)) s1.start()) forse sarò multithread, ma non è questo il giorno
         ids = self.__gen_first_level()
 
-        # create levels
-        self.__gen_sublevels(ids)
+        # create levels, subtrees of first level nodes are independent and can be generated by more processes
+        if self.WORKERS > 1:
+            self.__gen_sublevels_parallel(ids)
+        else:
+            self.__gen_sublevels(ids)
 
+        self.__create_hierarchy()
         self.__create_info()
         if "c" in self.type:
             self.__create_class_info()
@@ -340,45 +1083,67 @@ class Generator:
         print("Conversion finished in " + str(int(time.time() - start)) + " seconds")
         return self.dir
 
-    # generate the first level of octree-based structure, reading from file
+    # generate the first level of octree-based structure, reading the file only once
+    # every point is routed to the temporary bucket file of its octant, one chunk of points at a time
+    # only the reading is chunked: without maxram every bucket is then loaded whole, so memory grows with the densest octant
     def __gen_first_level(self):
         dir = self.dir + "r/"
         links = int('00000000', 2)
         rootp = []
         ids = []
-        with open(self.fileaddr, "r") as f:
-            for i in range(ord('a'), ord('a') + 8):
-                links = links << 1
-                id = chr(i)
-                file = dir + id + ".bin"
-                bb = self.bbmanager.id_to_bb(id)
-                nodep = []
+        buckets = []
+        counts = []
 
-                for line in f.readlines():
-                    values = line.split()
-                    if self.bbmanager.is_into(bb, float(values[0]), float(values[1]), float(values[2])):
-                        nodep.append(self.create_point(values))
+        for i in range(ord('a'), ord('a') + 8):
+            buckets.append(dir + chr(i) + ".tmp")
+            counts.append(0)
+
+        bfiles = [open(b, 'wb') for b in buckets]
+        try:
+            for points in self.__read_chunks():
+                octants = self.bbmanager.child_index(self.bbmanager.bb, points)
+
+                for o in range(8):
+                    octant = points[octants == o]
+                    if octant.shape[0] > 0:
+                        octant.tofile(bfiles[o])
+                        counts[o] += octant.shape[0]
+        finally:
+            for bf in bfiles:
+                bf.close()
+
+        rng = self.__random("r")
+        for o in range(8):
+            links = links << 1
+            id = chr(ord('a') + o)
+            file = self.__node_addr("r" + id)
+
+            if counts[o] > 0 and self.maxram is not None:
+                links = links + self.__split_bucket(id, counts[o], rng, rootp, ids)
+            elif counts[o] > 0:
+                nodep = np.fromfile(buckets[o]).reshape((counts[o], -1))
 
                 # rate value of root points still remain in root
-                if len(nodep) > 0:
-                    rate = (self.ROOTPOINTSN/8) / len(nodep)
-                    if rate < 1.0:
-                        limit = int(0.03 * len(nodep))
-                        indices = random.sample(range(len(nodep)), limit)
-                        nodep = np.array(nodep)
-                        rootp.extend(nodep[indices])
-                        nodep = np.delete(nodep, indices, axis=0)
-                        self.__store_node(file, Node(nodep))
-                        links = links + 1
-                        if len(nodep) > self.MAXPOINTSN:
-                            ids.append(id)
-                    else:
-                        rootp.extend(nodep)
+                rate = (self.ROOTPOINTSN/8) / len(nodep)
+                if rate < 1.0:
+                    limit = int(0.03 * len(nodep))
+                    indices = self.__sample(rng, len(nodep), limit, [nodep], self.bbmanager.id_to_bb(id))
+                    rootp.append(nodep[indices])
+                    nodep = np.delete(nodep, indices, axis=0)
+                    final = len(nodep) <= self.MAXPOINTSN
+                    self.__store_node(file, id, Node(nodep), final)
+                    links = links + 1
+                    if not final:
+                        ids.append(id)
+                else:
+                    rootp.append(nodep)
 
-                self.__beginning(f)
+            # the bucket of a node to unpack is its spill file
+            if self.maxram is None or id not in ids:
+                os.remove(buckets[o])
 
         # save root node
-        self.__store_node(dir + "../r.bin", Node(rootp, links.to_bytes(1, byteorder='big')))
+        self.__store_node(dir + "../r.bin", "r", Node(np.concatenate(rootp), links.to_bytes(1, byteorder='big')))
         # return ids that need to be unpacked
         return ids
 
@@ -386,24 +1151,262 @@ class Generator:
     def __gen_sublevels(self, ids, rootid = ""):
 
         for id in ids:
-            self.__gen_sublevels(self.__gen_sublevel(rootid + id, NodeLoader(self.dir).load_node(rootid + id)), rootid + id)
+            self.__gen_sublevels(self.__unpack(rootid + id), rootid + id)
+
+    # generate levels of octree-based structure with WORKERS processes that share a queue of nodes to unpack
+    # a node is taken by the first free worker, which sends back the children that need to be unpacked and this process
+    # puts them in the queue, so the subtree of a dense node is spread over all workers
+    # only this process puts nodes in the queue, so the nodes still to unpack are counted exactly and a worker that dies
+    # (e.g. killed for lack of memory) is found instead of waiting forever
+    def __gen_sublevels_parallel(self, ids):
+        tasks = Queue()
+        done = Queue()
+        errors = Queue()
+        workers = []
+        pending = len(ids)
+
+        for id in ids:
+            tasks.put(id)
+
+        for i in range(self.WORKERS):
+            workers.append(Process(target=self.__sublevels_worker, args=(tasks, done, errors,)))
+            workers[i].start()
+
+        while pending > 0:
+            try:
+                id, children, records = done.get(timeout=1)
+            except queue.Empty:
+                # workers exit only when all nodes are unpacked
+                dead = [w for w in workers if not w.is_alive()]
+                if len(dead) > 0:
+                    for w in workers:
+                        w.terminate()
+                    raise Exception('Sublevels generation failed: a worker exited with code ' + str(dead[0].exitcode))
+                continue
+
+            for child in children:
+                tasks.put(id + child)
+            pending += len(children) - 1
+            self.records.extend(records)
+
+        for w in workers:
+            tasks.put(None)
+        for w in workers:
+            w.join()
+
+        if not errors.empty():
+            raise Exception('Sublevels generation failed: ' + errors.get())
+
+    # records of the nodes appended to the archive by the worker are sent with every unpacked node
+    def __sublevels_worker(self, tasks, done, errors):
+        self.records = []
+        while True:
+            id = tasks.get()
+            if id is None:
+                return
+
+            children = []
+            try:
+                children = self.__unpack(id)
+            except Exception as e:
+                errors.put(id + ": " + repr(e))
+            finally:
+                done.put((id, children, self.records))
+                self.records = []
+
+    # positions of at most limit points, of the count points of a child node, that remain in its parent node
+    # points of the child are given in chunks (an iterable of arrays) and are read only by the grid sampler
+    def __sample(self, rng, count, limit, chunks, bb):
+        if self.sampler != "grid":
+            return rng.sample(range(count), limit)
+
+        grid = GridSampler(bb, self.GRIDSIZE // 2)
+        for points in chunks:
+            grid.add(points)
+        return grid.sample(rng, limit)
+
+    # source of the random sampling of a node (full id), when a seed is given it depends only on seed and node id
+    def __random(self, id):
+        if self.seed is None:
+            return random
+        return random.Random(str(self.seed) + id)
+
+    # split a node in its children and return the ids of the children that need to be unpacked
+    def __unpack(self, id):
+        if self.maxram is None:
+            return self.__gen_sublevel(id, self.__load_node("r" + id))
+        return self.__gen_sublevel_spilled(id)
+
+    # address of the file of a node (full id), with packed it is needed only until the node is unpacked (see __append_node)
+    # and it isn't in a directory hierarchy, so no directory is created for the levels of the octree
+    def __node_addr(self, id):
+        if self.packed:
+            return self.dir + "r/" + id + ".bin"
+        return self.dir + id_to_node(id)
+
+    # load a node to unpack (full id), with packed its file is removed: the node is stored again, in the archive, once unpacked
+    def __load_node(self, id):
+        addr = self.__node_addr(id)
+        with open(addr, 'rb') as r:
+            buffer = bytearray(os.fstat(r.fileno()).st_size)
+            r.readinto(buffer)
+        if self.packed:
+            os.remove(addr)
+        return read_node(buffer)
+
+    # OUT-OF-CORE BUILD
+    # with maxram, the points of a node to unpack are not stored in its .bin file but in a spill file of float64 rows
+    # a spill file is read one chunk of maxram bytes at a time, so memory doesn't depend on the size of the cloud:
+    # only the nodes that are written (at most MAXPOINTSN points) are held in memory
+
+    # address of the spill file of a node (id without 'r'), the one of a first level node is its bucket
+    def __spill_addr(self, id):
+        if self.packed:
+            return self.dir + "r/" + id + ".tmp"
+        return self.dir + "r/" + id_to_node(id)[:-len(".bin")] + ".tmp"
+
+    # read the points of a spill file one chunk of about maxram bytes at a time
+    def __read_spill(self, addr):
+        rows = max(1, self.maxram // (8 * self.dims))
+
+        with open(addr, 'rb') as f:
+            points = np.fromfile(f, count=rows * self.dims)
+            while points.size > 0:
+                yield points.reshape((-1, self.dims))
+                points = np.fromfile(f, count=rows * self.dims)
+
+    # same as the first level split of a bucket in memory: the sampled points go to root, the others to the node
+    # the points of root taken from a bucket are at most ROOTPOINTSN / 8. Return 1 if the node is created, 0 otherwise
+    def __split_bucket(self, id, count, rng, rootp, ids):
+        bucket = self.__spill_addr(id)
+        if (self.ROOTPOINTSN/8) / count >= 1.0:
+            rootp.append(np.fromfile(bucket).reshape((count, -1)))
+            return 0
+
+        indices = self.__sample(rng, count, min(int(0.03 * count), self.ROOTPOINTSN // 8), self.__read_spill(bucket), self.bbmanager.id_to_bb(id))
+        sampled = np.sort(indices)
+        final = count - len(indices) <= self.MAXPOINTSN
+        taken = []
+        nodep = []
+        start = 0
+
+        with open(bucket + ".part", 'wb') as part:
+            for points in self.__read_spill(bucket):
+                take = np.isin(np.arange(start, start + points.shape[0]), sampled)
+                start += points.shape[0]
+                taken.append(points[take])
+                if final:
+                    nodep.append(points[~take])
+                else:
+                    points[~take].tofile(part)
+
+        # sampled points in the order of the sample, as nodep[indices]
+        rootp.append(np.concatenate(taken)[np.searchsorted(sampled, indices)])
+
+        if final:
+            os.remove(bucket + ".part")
+            self.__store_node(self.dir + "r/" + id + ".bin", id, Node(np.concatenate(nodep)))
+        else:
+            os.replace(bucket + ".part", bucket)
+            ids.append(id)
+        return 1
+
+    # same as __gen_sublevel, reading the points of the node from its spill file twice:
+    # the first time to count the points of every child, the second to route every point to root, to a child in memory
+    # (final child) or to the spill file of the child. Points keep the order they would have with __gen_sublevel
+    def __gen_sublevel_spilled(self, rootid):
+        if not self.packed:
+            os.mkdir(self.dir + "r/" + id_to_path(rootid))
+        spill = self.__spill_addr(rootid)
+        bb = self.bbmanager.id_to_bb(rootid)
+        links = 0
+        ids = []
+
+        # the grids of the children are filled while counting their points
+        grids = None
+        if self.sampler == "grid":
+            grids = [GridSampler(self.bbmanager.id_to_bb(rootid + chr(ord('a')+n)), self.GRIDSIZE // 2) for n in range(8)]
+
+        counts = np.zeros(8, dtype=np.int64)
+        for points in self.__read_spill(spill):
+            children = self.bbmanager.child_index(bb, points)
+            counts += np.bincount(children, minlength=8)
+            if grids is not None:
+                for n in range(8):
+                    grids[n].add(points[children == n])
+
+        # sorted positions (into the points of the child) of the points that remain in root, None if the child isn't created
+        sampled = [None] * 8
+        final = [True] * 8
+        for n in range(8):
+            links = links << 1
+            if counts[n] > 0 and (self.MAXPOINTSN/8) / counts[n] < 1.0:
+                limit = int((self.MAXPOINTSN/8) / counts[n] * counts[n])
+                if grids is not None:
+                    sampled[n] = np.sort(grids[n].sample(self.__random("r" + rootid + chr(ord('a')+n)), limit))
+                else:
+                    sampled[n] = np.sort(self.__random("r" + rootid + chr(ord('a')+n)).sample(range(counts[n]), limit))
+                final[n] = counts[n] - len(sampled[n]) <= self.MAXPOINTSN
+                links = links + 1
+                if not final[n]:
+                    ids.append(chr(ord('a')+n))
+
+        rootp = []
+        nodep = [[] for n in range(8)]
+        spills = [None if final[n] or sampled[n] is None else open(self.__spill_addr(rootid + chr(ord('a')+n)), 'wb') for n in range(8)]
+        starts = np.zeros(8, dtype=np.int64)
+
+        try:
+            for points in self.__read_spill(spill):
+                children = self.bbmanager.child_index(bb, points)
+                moved = np.full((points.shape[0]), False)
+
+                for n in range(8):
+                    if sampled[n] is None:
+                        continue
+
+                    # positions of the points into the points of the child
+                    itomove = np.flatnonzero(children == n)
+                    positions = np.arange(starts[n], starts[n] + len(itomove))
+                    starts[n] += len(itomove)
+
+                    itomove = itomove[~np.isin(positions, sampled[n])]
+                    moved[itomove] = True
+
+                    if final[n]:
+                        nodep[n].append(points[itomove])
+                    else:
+                        points[itomove].tofile(spills[n])
+
+                rootp.append(points[~moved])
+        finally:
+            for f in spills:
+                if f is not None:
+                    f.close()
+
+        for n in range(8):
+            if sampled[n] is not None and final[n]:
+                self.__store_node(self.dir + "r/" + id_to_node(rootid+chr(ord('a')+n)), rootid+chr(ord('a')+n), Node(np.concatenate(nodep[n])))
+
+        self.__store_node(self.dir + "r/" + id_to_node(rootid), rootid, Node(np.concatenate(rootp), links.to_bytes(1, byteorder='big')))
+        os.remove(spill)
+        # remove empty directory
+        if links == 0 and not self.packed:
+            os.rmdir(self.dir + "r/" + id_to_path(rootid))
+        return ids
 
     # generate level of octree-based structure, reading from .bin node files
     def __gen_sublevel(self, rootid, root):
-        os.mkdir(self.dir + "r/" + id_to_path(rootid))
+        if not self.packed:
+            os.mkdir(self.dir + "r/" + id_to_path(rootid))
         dirneeded = False
         links = int.from_bytes(root.links, byteorder='big')
         ids = []
+        children = self.bbmanager.child_index(self.bbmanager.id_to_bb(rootid), root.points)
+        moved = np.full((root.points.shape[0]), False)
 
         for n in range(8):
-            mask = np.full((root.points.shape[0]), False)
-            itomove = []
-            bb = self.bbmanager.id_to_bb(rootid + chr(ord('a') + n))
-
-            for i in range(root.points.shape[0]):
-                if self.bbmanager.is_into(bb, root.points[i][0], root.points[i][1], root.points[i][2]):
-                    mask[i] = True
-                    itomove.append(i)
+            itomove = np.flatnonzero(children == n)
 
             # rate value of root points still remain in root
             links = links << 1
@@ -413,30 +1416,52 @@ class Generator:
                     limit = int(rate * len(itomove))
                     dirneeded = True
 
-                    # modify mask removing rate of not needed points
-                    for j in random.sample(itomove, limit):
-                        mask[j] = False
+                    # remove from the points to move the rate of points that remain in root
+                    childbb = self.bbmanager.id_to_bb(rootid + chr(ord('a')+n))
+                    itomove = np.delete(itomove, self.__sample(self.__random("r" + rootid + chr(ord('a')+n)), len(itomove), limit, [root.points[itomove]], childbb))
+                    moved[itomove] = True
 
-                    nodep = root.points[mask]
-                    root.points = np.delete(root.points, itomove[limit:], axis=0)
-                    self.__store_node(self.dir + "r/" + id_to_node(rootid+chr(ord('a')+n)), Node(nodep))
+                    nodep = root.points[itomove]
+                    final = len(nodep) <= self.MAXPOINTSN
+                    self.__store_node(self.__node_addr("r" + rootid+chr(ord('a')+n)), rootid+chr(ord('a')+n), Node(nodep), final)
                     links = links + 1
-                    if len(nodep) > self.MAXPOINTSN:
+                    if not final:
                         ids.append(chr(ord('a')+n))
 
         # update and save root node
+        root.points = root.points[~moved]
         root.links = links.to_bytes(1, byteorder='big')
-        self.__store_node(self.dir + "r/" + id_to_node(rootid), root)
+        self.__store_node(self.dir + "r/" + id_to_node(rootid), rootid, root)
         # remove empty directory
-        if not dirneeded:
+        if not dirneeded and not self.packed:
             os.rmdir(self.dir + "r/" + id_to_path(rootid))
         # return ids that need to be unpacked
         return ids
 
-    # save node through pickle
-    def __store_node(self, addr, node):
+    # save node in binary node format, final nodes (that will not be unpacked) are quantized if a precision is given
+    # with packed, final nodes are appended to the archive instead of being saved in addr
+    def __store_node(self, addr, id, node, final = True):
+        if final and self.precision is not None:
+            node = Node(quantize(node.points, self.bbmanager.id_to_bb(id), self.precision), node.links)
+
+        if final and self.packed:
+            self.__append_node(id, node)
+            return
+
         with open(addr, 'wb') as fn:
-            pickle.dump(node, fn)
+            write_node(fn, node)
+
+    # append a node (id without 'r', "r" for root) to the segment of the archive of this process, so the workers
+    # never write the same file, and record where it is. Segments are joined in the archive by __join_segments
+    def __append_node(self, id, node):
+        segment = self.dir + "r/" + str(os.getpid()) + ".seg"
+
+        with open(segment, 'ab') as s:
+            offset = s.tell()
+            write_node(s, node)
+            size = s.tell() - offset
+
+        self.records.append((id if id == "r" else "r" + id, int.from_bytes(node.links, byteorder='big'), node.points.shape[0], offset, size, segment))
 
     # go to the beginning of file, identify and skip the possible initial line with (for example) the number of points in the cloud
     def __beginning(self, f):
@@ -444,41 +1469,81 @@ class Generator:
         if len(f.readline().split()) != 1:
             f.seek(0, 0)
 
-    # calculate bounding box of point cloud and number of points
-    def __calc_bb_and_numpoints(self, f):
-        values = f.readline().split()
-        x = float(values[0])
-        y = float(values[1])
-        z = float(values[2])
-        self.pointsnum = 1
-
-        minx = x
-        maxx = x
-        miny = y
-        maxy = y
-        minz = z
-        maxz = z
-
-        for line in f.readlines():
-            self.pointsnum = self.pointsnum + 1
-            values = line.split()
-
-            if minx > float(values[0]):
-                minx = float(values[0])
-            elif maxx < float(values[0]):
-                maxx = float(values[0])
-
-            if miny > float(values[1]):
-                miny = float(values[1])
-            elif maxy < float(values[1]):
-                maxy = float(values[1])
-
-            if minz > float(values[2]):
-                minz = float(values[2])
-            elif maxz < float(values[2]):
-                maxz = float(values[2])
-
-        self.bbmanager = BBManager(BoundingBox(minx, miny, minz, maxx, maxy, maxz))
+    # read the points of the file one chunk of about CHUNKSIZE characters (or bytes) at a time, at most maxram if given
+    # a chunk of a text file always ends with a whole line
+    def __read_chunks(self):
+        chunksize = self.CHUNKSIZE if self.maxram is None else min(self.CHUNKSIZE, self.maxram)
+        ext = os.path.splitext(self.fileaddr)[1].lower()
+        if ext in POINT_READERS:
+            yield from POINT_READERS[ext](self.fileaddr, self.type, chunksize)
+            return
+
+        with open(self.fileaddr, "r") as f:
+            self.__beginning(f)
+            text = f.read(chunksize)
+
+            while len(text) > 0:
+                text += f.readline()
+                if len(text.strip()) > 0:
+                    yield parse_points(text, self.type)
+                text = f.read(chunksize)
+
+    # calculate bounding box of point cloud and number of points, reading the file one chunk of points at a time
+    def __calc_bb_and_numpoints(self):
+        mins = np.full(3, np.inf)
+        maxs = np.full(3, -np.inf)
+        self.pointsnum = 0
+
+        for points in self.__read_chunks():
+            mins = np.minimum(mins, points[:, :3].min(axis=0))
+            maxs = np.maximum(maxs, points[:, :3].max(axis=0))
+            self.pointsnum += points.shape[0]
+
+        self.bbmanager = BBManager(BoundingBox(*mins.tolist(), *maxs.tolist()))
+
+    # write hierarchy index visiting the octree in breadth-first order, reading only the header of the nodes
+    def __create_hierarchy(self):
+        if self.packed:
+            write_hierarchy(self.dir + HIERARCHY_FILE, self.__join_segments())
+            return
+
+        records = []
+        ids = ['r']
+
+        for id in ids:
+            addr = self.dir + id_to_node(id)
+            with open(addr, 'rb') as f:
+                links, pointsnum = read_node_header(f.read(NODE_HEADER.size))
+            records.append((id, links, pointsnum, 0, os.path.getsize(addr)))
+
+            for i in range(ord('a'), ord('a') + 8):
+                if node_exist(chr(i), links):
+                    ids.append(id + chr(i))
+
+        write_hierarchy(self.dir + HIERARCHY_FILE, records)
+
+    # copy the nodes of the segments in the archive file in breadth-first order (as the hierarchy index), every node
+    # starts at a multiple of 8 bytes, then remove the segments. Return the records of the hierarchy index
+    def __join_segments(self):
+        ret = []
+        segments = {}
+
+        try:
+            with open(self.dir + ARCHIVE_FILE, 'wb') as a:
+                for id, links, pointsnum, offset, size, segment in sorted(self.records, key=lambda r: (len(r[0]), r[0])):
+                    if segment not in segments:
+                        with open(segment, 'rb') as f:
+                            segments[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+                    ret.append((id, links, pointsnum, a.tell(), size))
+                    a.write(segments[segment][offset:offset + size])
+                    a.write(bytes(padded_size(size) - size))
+        finally:
+            for m in segments.values():
+                m.close()
+
+        shutil.rmtree(self.dir + "r")
+        return ret
 
     def __create_info(self):
         cloud = {
@@ -493,6 +1558,9 @@ class Generator:
             "maxz": self.bbmanager.bb.maxz
         }
 
+        if self.precision is not None:
+            cloud["precision"] = self.precision
+
         with open(self.dir+'/cloud.json', 'w') as infofile:
             json.dump(cloud, infofile)
 
@@ -501,24 +1569,6 @@ class Generator:
             with open(self.dir+'/classes.json', 'w') as classfile:
                 json.dump(self.classes, classfile)
 
-    def __xyz_point(self, values):
-        return Point(float(values[0]), float(values[1]), float(values[2]))
-
-    def __xyzrgb_point(self, values):
-        return Point(float(values[0]), float(values[1]), float(values[2]), float(values[3])/255.0, float(values[4])/255.0, float(values[5])/255.0)
-
-    def __xyzirgb_point(self, values):
-        return Point(float(values[0]), float(values[1]), float(values[2]), float(values[4])/255.0, float(values[5])/255.0, float(values[6])/255.0)
-
-    def __xyzc_point(self, values):
-        return Point(float(values[0]), float(values[1]), float(values[2]), None, None, None, float(values[3]))
-
-    def __xyzrgbc_point(self, values):
-        return Point(float(values[0]), float(values[1]), float(values[2]), float(values[3])/255.0, float(values[4])/255.0, float(values[5])/255.0, float(values[6]))
-
-    def __xyzirgbc_point(self, values):
-        return Point(float(values[0]), float(values[1]), float(values[2]), float(values[4])/255.0, float(values[5])/255.0, float(values[6])/255.0, float(values[7]))
-
     def get_generated_dir(self):
         return self.dir
 
@@ -528,31 +1578,65 @@ class Generator:
     def get_number_of_points(self):
         return self.pointsnum
 
+# cache of node points with least recently used replacement, all operations are O(1)
+# capacity is expressed in bytes of points (and optionally in number of nodes)
 class LRU:
 
-    def __init__(self, max = 128):
-        self.ids = []
-        self.points = []
+    # on_evict: function called with id and points of every node removed from cache
+    def __init__(self, max = None, maxbytes = 512 * 1024 * 1024, on_evict = None):
+        self.nodes = OrderedDict()
         self.max = max
+        self.maxbytes = maxbytes
+        self.on_evict = on_evict
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def exist(self, id):
-        return id in self.ids
+        return id in self.nodes
 
     # programmer must check if node exist before calling this function
     def extract_node_points(self, id):
-        index = self.ids.index(id)
-        self.ids.pop(index)
-        points = self.points.pop(index)
+        points = self.nodes[id]
         # move extracted node to the end of queue
-        self.ids.append(id)
-        self.points.append(points)
+        self.nodes.move_to_end(id)
+        self.hits += 1
         return points
 
+    # return the points of the node or None if node is not in cache
+    def get_node_points(self, id):
+        if id in self.nodes:
+            return self.extract_node_points(id)
+
+        self.misses += 1
+        return None
+
     def store_node(self, node):
-        self.ids.append(node.id)
-        self.points.append(node.points)
+        if node.id in self.nodes:
+            self.__remove(node.id, self.nodes.pop(node.id))
+
+        self.nodes[node.id] = node.points
+        self.bytes += points_size(node.points)
+
+        # If the cache reached maximum, remove the last recently used nodes
+        while self.bytes > self.maxbytes or (self.max is not None and len(self.nodes) > self.max):
+            self.evict()
+
+    # remove the last recently used node, return False if cache is empty
+    def evict(self):
+        if len(self.nodes) == 0:
+            return False
+
+        id, points = self.nodes.popitem(last=False)
+        self.__remove(id, points)
+        self.evictions += 1
+        return True
+
+    def __remove(self, id, points):
+        self.bytes -= points_size(points)
+        if self.on_evict is not None:
+            self.on_evict(id, points)
 
-        # If the cache reached maximum, remove the last recently used node
-        if len(self.ids) > self.max:
-            self.ids.pop(0)
-            self.points.pop(0)
\ No newline at end of file
+    def stats(self):
+        return {"nodes": len(self.nodes), "bytes": self.bytes, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
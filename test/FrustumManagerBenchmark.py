@@ -0,0 +1,57 @@
+import sys, time, numpy as np
+from FrustumManager import FrustumManager
+from FrustumManagerTest import mvp_matrix, random_boxes
+
+# benchmark of the frustum culling of bounding boxes, run with: python3 FrustumManagerBenchmark.py [BOXES]
+
+def timeit(f, repeat = 3):
+    best = None
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+def report(name, boxesnum, seconds):
+    print("{:<40} {:>10.3f} us/box".format(name, seconds / boxesnum * 1e6))
+
+# classification through the 8 corners and the center of the box, as FrustumManager used to do
+def sampled_bbox_in_frustum(fm, bb):
+    points = [[bb.minx, bb.miny, bb.minz], [bb.maxx, bb.miny, bb.minz], [bb.minx, bb.maxy, bb.minz], [bb.minx, bb.miny, bb.maxz],
+              [bb.maxx, bb.maxy, bb.minz], [bb.minx, bb.maxy, bb.maxz], [bb.maxx, bb.miny, bb.maxz], [bb.maxx, bb.maxy, bb.maxz],
+              [bb.get_midx(), bb.get_midy(), bb.get_midz()]]
+    in_frustum = 0
+
+    for p in points:
+        if fm.point_in_frustum(p[0], p[1], p[2]):
+            in_frustum += 1
+
+    if in_frustum == 0:
+        return 0
+    elif in_frustum < len(points):
+        return 1
+    else:
+        return 2
+
+def bench_culling(boxesnum):
+    fm = FrustumManager()
+    fm.update_frustum(mvp_matrix(np.array([1.0, 2.0, 3.0]), (0, 0, 0)))
+    bbs, bounds = random_boxes(boxesnum)
+
+    report("sampled corners (per box)", boxesnum, timeit(lambda: [sampled_bbox_in_frustum(fm, bb) for bb in bbs]))
+    report("p/n vertices (per box)", boxesnum, timeit(lambda: [fm.bbox_in_frustum(bb) for bb in bbs]))
+    report("p/n vertices + sphere (per box)", boxesnum, timeit(lambda: [fm.bbox_in_frustum(bb, True) for bb in bbs]))
+    report("p/n vertices (batch)", boxesnum, timeit(lambda: fm.bboxes_in_frustum(bounds)))
+    report("p/n vertices + sphere (batch)", boxesnum, timeit(lambda: fm.bboxes_in_frustum(bounds, True)))
+
+    # boxes that intersect the frustum but are reported totally out by the corners sampling
+    sampled = np.array([sampled_bbox_in_frustum(fm, bb) for bb in bbs])
+    exact = fm.bboxes_in_frustum(bounds)[0]
+    print("wrongly culled by sampled corners: " + str(np.count_nonzero((sampled == 0) & (exact > 0))) + " of " + str(boxesnum))
+
+if __name__ == '__main__':
+    bench_culling(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,85 @@
+import unittest, math, numpy as np
+import OctreeFormatTools as oft
+from FrustumManager import FrustumManager
+
+# return model * view * projection matrix (as a list of 16 values, row by row) of a camera in eye looking at center
+def mvp_matrix(eye, center, up = (0, 1, 0), fovy = 60, aspect = 1.0, near = 0.1, far = 100):
+    f = np.array(center, dtype=float) - eye
+    f /= np.linalg.norm(f)
+    s = np.cross(f, up)
+    s /= np.linalg.norm(s)
+    u = np.cross(s, f)
+
+    view = np.identity(4)
+    view[0, :3] = s
+    view[1, :3] = u
+    view[2, :3] = -f
+    view[:3, 3] = -view[:3, :3] @ eye
+
+    t = 1 / math.tan(math.radians(fovy) / 2)
+    projection = np.zeros((4, 4))
+    projection[0, 0] = t / aspect
+    projection[1, 1] = t
+    projection[2, 2] = (far + near) / (near - far)
+    projection[2, 3] = 2 * far * near / (near - far)
+    projection[3, 2] = -1
+
+    return list((projection @ view).flatten())
+
+# random bounding boxes around the origin, as BoundingBox objects and as array of bounds
+def random_boxes(n, seed = 0):
+    rng = np.random.default_rng(seed)
+    mins = rng.uniform(-20, 20, (n, 3))
+    bounds = np.hstack((mins, mins + rng.uniform(0.1, 15, (n, 3))))
+    return [oft.BoundingBox(*b) for b in bounds], bounds
+
+class FrustumManagerTest(unittest.TestCase):
+
+    # check that the batch culling gives the same results of bbox_in_frustum and dist_from_near, with and without sphere test
+    def test_bboxes_in_frustum(self):
+        fm = FrustumManager()
+        bbs, bounds = random_boxes(500)
+
+        for eye in [(0, 0, 30), (25, 10, 5), (1, 2, 3)]:
+            fm.update_frustum(mvp_matrix(np.array(eye, dtype=float), (0, 0, 0)))
+
+            for sphere in [False, True]:
+                visibility, dist = fm.bboxes_in_frustum(bounds, sphere)
+
+                for i in range(len(bbs)):
+                    self.assertEqual(fm.bbox_in_frustum(bbs[i], sphere), visibility[i])
+                    self.assertEqual(fm.bbox_in_frustum(bbs[i]), visibility[i])
+                    self.assertAlmostEqual(fm.dist_from_near(bbs[i].get_midx(), bbs[i].get_midy(), bbs[i].get_midz()), dist[i])
+
+    # check the classification against points sampled into the boxes: a box with a point into the frustum is never out
+    # and a box is totally into frustum only if all its corners are
+    def test_bbox_in_frustum_exact(self):
+        fm = FrustumManager()
+        bbs, bounds = random_boxes(300, 1)
+        grid = np.stack(np.meshgrid(*[np.linspace(0, 1, 6)] * 3), axis=-1).reshape((-1, 3))
+
+        for eye in [(0, 0, 30), (25, 10, 5), (1, 2, 3)]:
+            fm.update_frustum(mvp_matrix(np.array(eye, dtype=float), (0, 0, 0)))
+            visibility, dist = fm.bboxes_in_frustum(bounds)
+
+            for i in range(len(bbs)):
+                points = bounds[i, :3] + grid * (bounds[i, 3:] - bounds[i, :3])
+                inside = [fm.point_in_frustum(*p) for p in points]
+
+                if any(inside):
+                    self.assertNotEqual(0, visibility[i])
+                if visibility[i] == 2:
+                    self.assertTrue(all(inside))
+
+    # a box bigger than the frustum, with no corner into it, is partially into frustum
+    def test_bbox_around_frustum(self):
+        fm = FrustumManager()
+        fm.update_frustum(mvp_matrix(np.array([0, 0, 5], dtype=float), (0, 0, 0), far=20))
+        bb = oft.BoundingBox(-50, -50, -50, 50, 50, 50)
+
+        self.assertEqual(1, fm.bbox_in_frustum(bb))
+        self.assertEqual(1, fm.bbox_in_frustum(bb, True))
+        self.assertEqual(0, fm.bbox_in_frustum(oft.BoundingBox(-50, -50, 10, 50, 50, 50)))
+
+if __name__ == '__main__':
+    unittest.main()
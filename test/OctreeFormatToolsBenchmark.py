@@ -0,0 +1,88 @@
+import sys, os, time, numpy as np
+import OctreeFormatTools as oft
+
+# micro-benchmarks of the converter, run with: python3 OctreeFormatToolsBenchmark.py [POINTS] [FILEPOINTS]
+# FILEPOINTS is the number of points of the synthetic file used by the parsing benchmark, 50000000 makes a file of about 4 GB
+
+def timeit(f, repeat = 3):
+    best = None
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+def report(name, pointsnum, seconds):
+    print("{:<40} {:>14,.0f} points/sec".format(name, pointsnum / seconds))
+
+# partitioning of the points of a node into its 8 children
+def bench_partition(pointsnum):
+    bm = oft.BBManager(oft.BoundingBox(0, 0, 0, 100, 100, 100))
+    bb = bm.get_bounding_box()
+    points = np.random.rand(pointsnum, 3) * 100
+
+    # one is_into call for every point and every child, as the converter used to do
+    def per_point():
+        for n in range(8):
+            cbb = bm.id_to_bb(chr(ord('a') + n))
+            for i in range(points.shape[0]):
+                bm.is_into(cbb, points[i][0], points[i][1], points[i][2])
+
+    def vectorized():
+        children = bm.child_index(bb, points)
+        for n in range(8):
+            np.flatnonzero(children == n)
+
+    report("partition (is_into per point)", pointsnum, timeit(per_point, 1))
+    report("partition (child_index)", pointsnum, timeit(vectorized))
+
+# write a synthetic xyzirgbc file, one block of points at a time
+def write_cloud(addr, pointsnum, block = 1000000):
+    with open(addr, 'w') as f:
+        f.write(str(pointsnum) + "\n")
+        for start in range(0, pointsnum, block):
+            n = min(block, pointsnum - start)
+            points = np.hstack([np.random.rand(n, 3) * 1000, np.random.randint(0, 256, (n, 5))])
+            np.savetxt(f, points, fmt='%.6f %.6f %.6f %d %d %d %d %d')
+
+# parsing of a text file with header and intensity column
+def bench_parse(pointsnum):
+    addr = "bench.xyz"
+    chunksize = 32 * 1024 * 1024
+    write_cloud(addr, pointsnum)
+
+    # one Point for every line, copied in a numpy row by Node, as the converter used to do (only the first chunk)
+    def per_line():
+        with open(addr, 'r') as f:
+            f.readline()
+            lines = f.readlines(chunksize)
+            points = [oft.Point(float(v[0]), float(v[1]), float(v[2]), float(v[4])/255.0, float(v[5])/255.0, float(v[6])/255.0, float(v[7])) for v in [line.split() for line in lines]]
+            oft.Node(points)
+        return len(lines)
+
+    def vectorized():
+        with open(addr, 'r') as f:
+            f.readline()
+            text = f.read(chunksize)
+            while len(text) > 0:
+                text += f.readline()
+                oft.parse_points(text, "xyzirgbc")
+                text = f.read(chunksize)
+
+    try:
+        print("file of " + str(os.path.getsize(addr) // (1024 * 1024)) + " MB")
+        start = time.perf_counter()
+        linesnum = per_line()
+        report("parse (Point per line)", linesnum, time.perf_counter() - start)
+        report("parse (parse_points)", pointsnum, timeit(vectorized, 1))
+    finally:
+        os.remove(addr)
+
+if __name__ == '__main__':
+    pointsnum = int(sys.argv[1]) if len(sys.argv) > 1 else 80000
+    bench_partition(pointsnum)
+    bench_parse(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
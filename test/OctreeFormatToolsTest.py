@@ -1,6 +1,57 @@
-import unittest, os, shutil
+import unittest, os, shutil, random, pickle, struct, numpy as np
+from multiprocessing import Process, Queue
 import OctreeFormatTools as oft
 
+# return the content of all node files of an octree directory
+def read_tree(dir):
+    files = {}
+    for path, dirs, names in os.walk(dir):
+        for name in names:
+            if name.endswith(".bin") and name != oft.HIERARCHY_FILE:
+                with open(os.path.join(path, name), 'rb') as f:
+                    files[os.path.relpath(os.path.join(path, name), dir)] = f.read()
+    return files
+
+# return the full id of a node from its file path into the octree directory, for example r/a/b.bin -> rab
+def file_to_id(file):
+    return file[:-len(".bin")].replace("/", "")
+
+# write an uncompressed LAS file with point data record format 3 (version 1.2) or 7 (version 1.4), colours are 16 bit
+def write_las(addr, xyz, rgb, c, format, scale, origin):
+    minor = 4 if format >= 6 else 2
+    size = 375 if minor == 4 else 227
+    length = 36 if format >= 6 else 34
+    header = bytearray(size)
+    header[:4] = b'LASF'
+    header[24] = 1
+    header[25] = minor
+    struct.pack_into('<HII', header, 94, size, size, 0)
+    struct.pack_into('<BHI', header, 104, format, length, 0 if minor == 4 else xyz.shape[0])
+    struct.pack_into('<3d3d', header, 131, *scale, *origin)
+    if minor == 4:
+        struct.pack_into('<Q', header, 247, xyz.shape[0])
+
+    records = np.zeros((xyz.shape[0], length), dtype='u1')
+    records[:, :12] = np.rint((xyz - origin) / scale).astype('<i4').view('u1')
+    # in format 3 the bits over the class are flags
+    records[:, 15 if format < 6 else 16] = c[:, 0] + (128 if format < 6 else 0)
+    records[:, 28 if format < 6 else 30:][:, :6] = (rgb * 257).astype('<u2').view('u1')
+
+    with open(addr, 'wb') as f:
+        f.write(header)
+        f.write(records.tobytes())
+
+# write a binary little endian PLY file with a face element before the vertices
+def write_ply(addr, vertices):
+    with open(addr, 'wb') as f:
+        f.write(b'ply\nformat binary_little_endian 1.0\ncomment test\nelement face 2\nproperty int a\n')
+        f.write(b'element vertex ' + str(vertices.shape[0]).encode() + b'\n')
+        for name in vertices.dtype.names:
+            f.write(b'property ' + {'f8': b'double', 'u1': b'uchar'}[vertices.dtype[name].str[1:]] + b' ' + name.encode() + b'\n')
+        f.write(b'end_header\n')
+        f.write(bytes(8))
+        f.write(vertices.tobytes())
+
 class OctreeFormatToolsTest(unittest.TestCase):
 
     def test_midpoint(self):
@@ -146,6 +197,208 @@ class OctreeFormatToolsTest(unittest.TestCase):
         check_bb(bm.id_to_bb("gc"), 0, 6, 4, 2, 8, 6)
         check_bb(bm.id_to_bb("hd"), 6, 6, 4, 8, 8, 6)
 
+    # check that intensity is skipped, colours are scaled and extra columns are ignored
+    def test_parse_points(self):
+        text = "1.5 2 3 7 255 0 51 4\n-1 -2 -3e2 8 0 255 102 5\n"
+
+        points = oft.parse_points(text, "xyzirgbc")
+        self.assertTrue(np.array_equal(points, [[1.5, 2, 3, 1, 0, 0.2, 4], [-1, -2, -300, 0, 1, 0.4, 5]]))
+        self.assertTrue(np.array_equal(oft.parse_points(text, "xyz"), [[1.5, 2, 3], [-1, -2, -300]]))
+        self.assertTrue(np.array_equal(oft.parse_points("1 2 3 4\n5 6 7\n", "xyz"), [[1, 2, 3], [5, 6, 7]]))
+        self.assertTrue(np.array_equal(oft.parse_points("1 2 3", "xyz"), [[1, 2, 3]]))
+
+        # lines with different columns, blank lines and values that aren't numbers
+        self.assertTrue(np.array_equal(oft.parse_points("1 2 3\n4 5 6 7 8 9\n", "xyz"), [[1, 2, 3], [4, 5, 6]]))
+        self.assertTrue(np.array_equal(oft.parse_points("1 2 3 4\n\n5 6 7\n", "xyz"), [[1, 2, 3], [5, 6, 7]]))
+        self.assertRaises(Exception, oft.parse_points, "1 2 3\n4 5\n6 7 8\n", "xyz")
+        self.assertRaises(Exception, oft.parse_points, "1 2 3\n4 x 6\n7 8 9\n", "xyz")
+        self.assertRaises(Exception, oft.parse_points, "1 2 3\n4 5 6\n7 8 x\n", "xyz")
+
+        # the last line of a file can have no newline, also alone in the last chunk
+        try:
+            with open("nonewline.xyz", "w") as f:
+                f.write("1 2 3\n4 5 6\n7 8 9")
+            dir = oft.Generator("nonewline.xyz", "xyz", chunksize=6).parse()
+            self.assertEqual(3, oft.Hierarchy(oft.gen_hierarchy(dir)).pointsnum.sum())
+        finally:
+            os.remove("nonewline.xyz")
+            shutil.rmtree("./nonewlineOctree", ignore_errors=True)
+
+    # check that points of binary files are read with the same values of text files, in chunks
+    def test_binary_readers(self):
+        points = np.loadtxt("less.xyz")
+        c = np.random.RandomState(1).randint(0, 20, (points.shape[0], 1))
+        expected = np.hstack([points[:, :3], points[:, 3:6] / 255.0, c])
+        scale = np.array([0.001, 0.001, 0.0001])
+        origin = np.array([-80.0, -30.0, 2.0])
+
+        def read(reader, addr, structure):
+            chunks = list(reader(addr, structure, 4096))
+            self.assertTrue(len(chunks) > 1)
+            return np.concatenate(chunks)
+
+        try:
+            for format in [3, 7]:
+                write_las("binary.las", points[:, :3], points[:, 3:6], c, format, scale, origin)
+                self.assertEqual("xyzrgbc", oft.file_structure("binary.las"))
+                las = read(oft.read_las, "binary.las", "xyzrgbc")
+                self.assertTrue(np.array_equal(np.rint((points[:, :3] - origin) / scale) * scale + origin, las[:, :3]))
+                self.assertTrue(np.array_equal(expected[:, 3:], las[:, 3:]))
+                self.assertTrue(np.array_equal(las[:, :3], read(oft.read_las, "binary.las", "xyz")))
+
+            vertices = np.zeros(points.shape[0], dtype=[('x', 'f8'), ('y', 'f8'), ('z', 'f8'), ('red', 'u1'), ('green', 'u1'), ('blue', 'u1'), ('class', 'u1')])
+            for i, name in enumerate(['x', 'y', 'z', 'red', 'green', 'blue', 'class']):
+                vertices[name] = np.hstack([points, c])[:, i]
+
+            write_ply("binary.ply", vertices)
+            self.assertEqual("xyzrgbc", oft.file_structure("binary.ply"))
+            self.assertTrue(np.array_equal(expected, read(oft.read_ply, "binary.ply", "xyzrgbc")))
+            self.assertTrue(np.array_equal(expected[:, [0, 1, 2, 6]], read(oft.read_ply, "binary.ply", "xyzc")))
+
+            np.save("binary.npy", vertices)
+            self.assertEqual("xyzrgbc", oft.file_structure("binary.npy"))
+            self.assertTrue(np.array_equal(expected, read(oft.read_npy, "binary.npy", "xyzrgbc")))
+
+            # columns of a plain array are the ones of a text file
+            np.save("binary.npy", np.hstack([points[:, :3], c, points[:, 3:6]]).astype('f4'))
+            single = points.astype('f4').astype('f8')
+            single[:, 3:6] /= 255.0
+            self.assertTrue(np.array_equal(single, read(oft.read_npy, "binary.npy", "xyzirgb")))
+            self.assertRaises(Exception, list, oft.read_ply("binary.npy", "xyz", 4096))
+        finally:
+            for file in ["binary.las", "binary.ply", "binary.npy"]:
+                if os.path.exists(file):
+                    os.remove(file)
+
+    # check that the octree converted from a numpy file is the same converted from the text file with the same points
+    def test_npy_conversion(self):
+        try:
+            np.save("lessnpy.npy", np.loadtxt("less.xyz"))
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000, seed=5).parse()
+            expected = read_tree(dir)
+
+            dir = oft.Generator("lessnpy.npy", "xyzrgb", None, 1000, chunksize=4096, seed=5).parse()
+            self.assertEqual(expected, read_tree(dir))
+        finally:
+            shutil.rmtree("./lessOctree")
+            shutil.rmtree("./lessnpyOctree", ignore_errors=True)
+            os.remove("lessnpy.npy")
+
+    # check that child_index assigns every point to the same child found through is_into, also on the faces of the boxes
+    def test_child_index(self):
+        bm = oft.BBManager(oft.BoundingBox(0, 0, 0, 8, 8, 8))
+        points = np.array([[0, 0, 0], [4, 4, 4], [8, 8, 8], [3.9, 8, 0], [8, 0, 4], [2, 6, 7.5], [4, 3, 8]])
+        children = bm.child_index(bm.get_bounding_box(), points)
+
+        for i in range(points.shape[0]):
+            id = chr(ord('a') + children[i])
+            self.assertTrue(bm.is_into(bm.id_to_bb(id), points[i][0], points[i][1], points[i][2]))
+
+        points = np.array([[4, 4, 4], [8, 8, 8], [6, 6, 6], [5.9, 4, 8]])
+        children = bm.child_index(bm.id_to_bb("h"), points)
+
+        for i in range(points.shape[0]):
+            id = "h" + chr(ord('a') + children[i])
+            self.assertTrue(bm.is_into(bm.id_to_bb(id), points[i][0], points[i][1], points[i][2]))
+
+    # check that bounds, midpoints and radius of the table are the same computed through id_to_bb
+    def test_node_bounds(self):
+        bm = oft.BBManager(oft.BoundingBox(-3.7, 0.1, 2, 11.3, 7.9, 5.5))
+        ig = oft.IdGenerator(3)
+        ids = ["r"]
+        id = ig.next()
+        while id is not None:
+            ids.append("r" + id)
+            id = ig.next()
+
+        nb = oft.NodeBounds(bm, ids)
+
+        for id in ids:
+            h = nb.get_handle(id)
+            bb = bm.id_to_bb(id)
+            self.assertEqual(bb.get_bounds(), tuple(nb.bounds[h]))
+            self.assertEqual(bb.get_bounds(), nb.get_bounding_box(h).get_bounds())
+            self.assertEqual([bb.get_midx(), bb.get_midy(), bb.get_midz()], list(nb.mids[h]))
+            self.assertEqual(bb.get_radius(), nb.radius[h])
+
+    # check that the flat hierarchy has the same tree of VisNode objects
+    def test_flat_hierarchy(self):
+        def check_node(vnode):
+            h = hierarchy.get_handle(vnode.id)
+            self.assertEqual(vnode.id, hierarchy.get_id(h))
+            self.assertEqual(vnode.pointsnum, hierarchy.pointsnum[h])
+            self.assertEqual([n.id for n in vnode.links], [hierarchy.get_id(c) for c in hierarchy.children(h)])
+            for c in hierarchy.children(h):
+                self.assertEqual(h, hierarchy.parent[c])
+            for n in vnode.links:
+                check_node(n)
+
+        try:
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000).parse()
+            visroot = oft.gen_hierarchy(dir)
+            hierarchy = oft.Hierarchy(visroot)
+
+            self.assertEqual(0, hierarchy.get_handle("r"))
+            self.assertEqual(-1, hierarchy.parent[0])
+            check_node(visroot)
+            self.assertEqual(sorted(range(len(hierarchy))), sorted(hierarchy.subtree(0)))
+            for h in hierarchy.subtree(1):
+                self.assertTrue(hierarchy.get_id(h).startswith(hierarchy.get_id(1)))
+
+            # active nodes are counted in the subtrees of all their ancestors
+            leaf = hierarchy.subtree(1)[-1]
+            hierarchy.activate(leaf)
+            hierarchy.activate(leaf)
+            hierarchy.activate(1)
+            self.assertTrue(hierarchy.active[leaf])
+            self.assertEqual(2, hierarchy.active_below[0])
+            self.assertEqual(1, hierarchy.active_below[1])
+            self.assertEqual(0, hierarchy.active_below[leaf])
+            hierarchy.deactivate(leaf)
+            self.assertEqual(1, hierarchy.active_below[0])
+            self.assertEqual(0, hierarchy.active_below[1])
+
+            # points and bytes of active nodes are taken from the hierarchy index
+            self.assertEqual(1, hierarchy.active_num)
+            self.assertEqual(hierarchy.pointsnum[1], hierarchy.active_points)
+            self.assertEqual(os.path.getsize(dir + oft.id_to_node(hierarchy.get_id(1))), hierarchy.active_size)
+        finally:
+            shutil.rmtree("./lessOctree")
+
+    # check that only rendered leaves are swapped out, by min priority, and only to make room for nodes with higher priority
+    def test_evictables(self):
+        def visnode(id, links = []):
+            n = oft.VisNode(id)
+            n.pointsnum = 10
+            n.links = links
+            return n
+
+        hierarchy = oft.Hierarchy(visnode("r", [visnode("ra", [visnode("raa"), visnode("rab")]), visnode("rb", [visnode("rba")])]))
+        priorities = {"r": 9, "ra": 5, "rb": 2, "raa": 3, "rab": 4, "rba": 8}
+        priority = lambda h: priorities[hierarchy.get_id(h)]
+        fits = lambda nodes, points, size: points + 10 <= 40
+        for id in ["r", "ra", "raa", "rb"]:
+            hierarchy.activate(hierarchy.get_handle(id))
+
+        evictables = oft.Evictables(hierarchy, priority, {hierarchy.get_handle("raa")})
+        self.assertEqual(["rb"], [hierarchy.get_id(h) for _, h in evictables.heap])
+
+        # nothing is removed for a node with lower priority or for a child of the node to evict
+        self.assertIsNone(evictables.make_room(hierarchy.get_handle("rab"), 1, fits))
+        self.assertIsNone(evictables.make_room(hierarchy.get_handle("rba"), 8, fits))
+        self.assertEqual(4, hierarchy.active_num)
+
+        evictables = oft.Evictables(hierarchy, priority)
+        self.assertEqual(["rb"], [hierarchy.get_id(h) for h in evictables.make_room(hierarchy.get_handle("rab"), 4, fits)])
+        self.assertFalse(hierarchy.active[hierarchy.get_handle("rb")])
+
+        # the parent of an evicted leaf becomes a leaf of the rendered nodes
+        fits = lambda nodes, points, size: points + 10 <= 30
+        self.assertEqual(["raa"], [hierarchy.get_id(h) for h in evictables.make_room(hierarchy.get_handle("rba"), 8, fits)])
+        fits = lambda nodes, points, size: points + 10 <= 20
+        self.assertEqual(["ra"], [hierarchy.get_id(h) for h in evictables.make_room(hierarchy.get_handle("rba"), 8, fits)])
+        self.assertEqual(1, hierarchy.active_num)
+
     # check if the number of points before and after the conversion is the same
     def test_points_number(self):
         def calc_number(vnode):
@@ -181,6 +434,199 @@ class OctreeFormatToolsTest(unittest.TestCase):
         finally:
             shutil.rmtree("./lessOctree")
 
+    # check that the conversion doesn't depend on the size of the chunks in which the file is read
+    def test_chunked_conversion(self):
+        try:
+            random.seed(7)
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000).parse()
+            expected = read_tree(dir)
+            shutil.rmtree("./lessOctree")
+
+            random.seed(7)
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000, chunksize=4096).parse()
+            self.assertEqual(expected, read_tree(dir))
+        finally:
+            shutil.rmtree("./lessOctree")
+
+    # check that the out-of-core build, with small spill chunks, generates the same octree of the build in memory
+    def test_spilled_conversion(self):
+        try:
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 300, seed=4).parse()
+            expected = read_tree(dir)
+            shutil.rmtree("./lessOctree")
+
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 300, seed=4, maxram=4096).parse()
+            self.assertEqual(expected, read_tree(dir))
+            shutil.rmtree("./lessOctree")
+
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 300, workers=3, seed=4, maxram=4096).parse()
+            self.assertEqual(expected, read_tree(dir))
+            for path, dirs, names in os.walk(dir):
+                self.assertFalse(any(name.endswith(".tmp") for name in names))
+        finally:
+            shutil.rmtree("./lessOctree")
+
+    # check that the grid sampler chooses the point closest to the center of every occupied cell, also with more chunks
+    def test_grid_sampler(self):
+        grid = oft.GridSampler(oft.BoundingBox(0, 0, 0, 4, 4, 4), 4)
+        grid.add(np.array([[0.1, 0.1, 0.1], [0.5, 0.5, 0.5], [3.9, 3.9, 3.9]]))
+        grid.add(np.array([[3.5, 3.5, 3.5], [1.5, 0.5, 0.5], [0.6, 0.5, 0.5], [2.0, 2.0, 2.0]]))
+        self.assertEqual([1, 3, 4, 6], sorted(grid.sample(random.Random(1), 10)))
+        self.assertEqual(2, len(grid.sample(random.Random(1), 2)))
+
+        # coincident points are sampled at random
+        grid = oft.GridSampler(oft.BoundingBox(0, 0, 0, 4, 4, 4), 4)
+        grid.add(np.ones((20, 3)))
+        self.assertEqual(5, len(set(grid.sample(random.Random(1), 5))))
+
+    # check that the grid sampler keeps all points, in the same octree with the build in memory and out of core
+    def test_grid_conversion(self):
+        try:
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 300, seed=6, sampler="grid").parse()
+            expected = read_tree(dir)
+            hierarchy = oft.Hierarchy(oft.gen_hierarchy(dir))
+            self.assertEqual(10000, hierarchy.pointsnum.sum())
+            shutil.rmtree("./lessOctree")
+
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 300, seed=6, sampler="grid", maxram=4096).parse()
+            self.assertEqual(expected, read_tree(dir))
+            shutil.rmtree("./lessOctree")
+
+            with self.assertRaises(Exception):
+                oft.Generator("less.xyz", "xyzrgb", sampler="poisson").parse()
+        finally:
+            shutil.rmtree("./lessOctree", ignore_errors=True)
+
+    # check that with a seed the octree generated by more processes is the same generated by one process
+    def test_parallel_conversion(self):
+        try:
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000, seed=3).parse()
+            expected = read_tree(dir)
+            shutil.rmtree("./lessOctree")
+
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000, workers=3, seed=3).parse()
+            self.assertEqual(expected, read_tree(dir))
+        finally:
+            shutil.rmtree("./lessOctree")
+
+    # check that the conversion fails, instead of waiting forever, if a worker process dies
+    def test_parallel_conversion_dead_worker(self):
+        try:
+            gen = oft.Generator("less.xyz", "xyzrgb", None, 1000, workers=2)
+            gen._Generator__unpack = lambda id: os._exit(1)
+            self.assertRaises(Exception, gen.parse)
+        finally:
+            shutil.rmtree("./lessOctree")
+
+    # check that a node written in binary node format is read with the same points and links, as a view of the buffer
+    def test_binary_node(self):
+        node = oft.Node(np.random.rand(100, 7), b'\x85')
+
+        with open("r.bin", "wb") as f:
+            oft.write_node(f, node)
+
+        try:
+            loaded = oft.NodeLoader("./").load_root()
+            self.assertEqual(node.links, loaded.links)
+            self.assertTrue(np.array_equal(node.points, loaded.points))
+            self.assertFalse(loaded.points.flags.owndata)
+        finally:
+            os.remove("r.bin")
+
+    # check that nodes of old octrees, saved through pickle, are still loaded
+    def test_pickle_node(self):
+        node = oft.Node(np.random.rand(100, 3), b'\x01')
+
+        with open("r.bin", "wb") as f:
+            pickle.dump(node, f)
+
+        try:
+            loaded = oft.NodeLoader("./").load_root()
+            self.assertEqual(node.links, loaded.links)
+            self.assertTrue(np.array_equal(node.points, loaded.points))
+        finally:
+            os.remove("r.bin")
+
+    # check that quantized nodes, converted back to float64, have the points of not quantized nodes within the precision
+    def test_quantized_conversion(self):
+        try:
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000, seed=3).parse()
+            expected = read_tree(dir)
+            shutil.rmtree("./lessOctree")
+
+            gen = oft.Generator("less.xyz", "xyzrgb", None, 1000, seed=3, precision=0.001)
+            dir = gen.parse()
+            quantized = read_tree(dir)
+            self.assertEqual(expected.keys(), quantized.keys())
+
+            for file in expected:
+                id = file_to_id(file)
+                points = oft.read_node(bytearray(expected[file])).points
+                qpoints = oft.read_node(bytearray(quantized[file])).points
+                self.assertIsInstance(qpoints, oft.QuantizedPoints)
+                self.assertEqual(points.shape, qpoints.shape)
+                self.assertLess(qpoints.nbytes * 3, points.nbytes)
+
+                dequantized = qpoints.dequantize(gen.get_bounding_box_manager().id_to_bb(id), 0.001)
+                self.assertTrue(np.allclose(points[:, :3], dequantized[:, :3], rtol=0, atol=0.0005 + 1e-9))
+                self.assertTrue(np.allclose(points[:, 3:], dequantized[:, 3:]))
+        finally:
+            shutil.rmtree("./lessOctree")
+
+    # check that the hierarchy read from the index is the same obtained loading all nodes
+    def test_hierarchy_index(self):
+        def check_hierarchy(a, b):
+            self.assertEqual(a.id, b.id)
+            self.assertEqual(a.pointsnum, b.pointsnum)
+            self.assertEqual([n.id for n in a.links], [n.id for n in b.links])
+            for i in range(len(a.links)):
+                check_hierarchy(a.links[i], b.links[i])
+
+        try:
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000).parse()
+            self.assertTrue(os.path.exists(dir + oft.HIERARCHY_FILE))
+            indexed = oft.gen_hierarchy(dir)
+
+            os.remove(dir + oft.HIERARCHY_FILE)
+            loaded = oft.gen_hierarchy(dir)
+            self.assertEqual(oft.NodeLoader(dir).load_root().points.shape[0], loaded.pointsnum)
+            check_hierarchy(loaded, indexed)
+        finally:
+            shutil.rmtree("./lessOctree")
+
+    # check that nodes loaded from the packed archive are the same of the directory hierarchy
+    def test_packed_conversion(self):
+        try:
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000, seed=3).parse()
+            expected = read_tree(dir)
+            shutil.rmtree("./lessOctree")
+
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000, seed=3, packed=True).parse()
+            self.assertEqual({}, read_tree(dir))
+            self.assertTrue(os.path.exists(dir + oft.ARCHIVE_FILE))
+
+            nl = oft.NodeLoader(dir)
+            for file in expected:
+                node = oft.read_node(bytearray(expected[file]))
+                loaded = nl.load_node_full_addr(file_to_id(file))
+                self.assertEqual(node.links, loaded.links)
+                self.assertTrue(np.array_equal(node.points, loaded.points))
+
+            self.assertEqual(len(expected), len(nl.index))
+            self.assertEqual([], [f for f in os.listdir(dir) if os.path.isdir(dir + f)])
+            with open(dir + oft.ARCHIVE_FILE, 'rb') as f:
+                archive = f.read()
+            shutil.rmtree("./lessOctree")
+
+            # nodes written by more processes, or out of core, are packed in the same archive
+            for options in [{"workers": 3}, {"workers": 3, "maxram": 4096}]:
+                dir = oft.Generator("less.xyz", "xyzrgb", None, 1000, seed=3, packed=True, **options).parse()
+                with open(dir + oft.ARCHIVE_FILE, 'rb') as f:
+                    self.assertEqual(archive, f.read())
+                shutil.rmtree("./lessOctree")
+        finally:
+            shutil.rmtree("./lessOctree", ignore_errors=True)
+
     def test_lru(self):
         lru = oft.LRU(3)
         self.assertFalse(lru.exist("a"))
@@ -213,5 +659,66 @@ class OctreeFormatToolsTest(unittest.TestCase):
         lru.store_node(v1)
         self.assertTrue(lru.exist("a"))
 
+    # check that the capacity in bytes is respected and that counters are updated
+    def test_lru_bytes(self):
+        lru = oft.LRU(maxbytes=3 * 800)
+
+        for c in "abcd":
+            lru.store_node(oft.VisNode(c, np.zeros((100, 1))))
+
+        self.assertFalse(lru.exist("a"))
+        self.assertEqual(3 * 800, lru.bytes)
+        self.assertEqual(1, lru.evictions)
+
+        self.assertIsNone(lru.get_node_points("a"))
+        self.assertIsNotNone(lru.get_node_points("b"))
+        lru.store_node(oft.VisNode("e", np.zeros((200, 1))))
+        self.assertTrue(lru.exist("b"))
+        self.assertFalse(lru.exist("c"))
+        self.assertFalse(lru.exist("d"))
+
+        # storing again a node replaces it
+        lru.store_node(oft.VisNode("b", np.zeros((100, 1))))
+        self.assertEqual(3 * 800, lru.bytes)
+        self.assertEqual({"nodes": 2, "bytes": 2400, "hits": 1, "misses": 1, "evictions": 3}, lru.stats())
+
+    # check that nodes copied in the arena are read back as views of the shared memory and that slots are recycled
+    def test_node_arena(self):
+        try:
+            dir = oft.Generator("less.xyz", "xyzrgb", None, 1000).parse()
+            nl = oft.NodeLoader(dir)
+            arena = oft.NodeArena(2, nl.get_max_node_size())
+
+            id = oft.gen_hierarchy(dir).links[0].id
+
+            try:
+                index = arena.alloc()
+                slot = oft.Slot(index, nl.load_into(id, arena.get_buffer(index)))
+                node = arena.read(slot)
+                self.assertTrue(np.array_equal(nl.load_node_full_addr(id).points, node.points))
+                self.assertEqual(nl.load_node_full_addr(id).links, node.links)
+                del node
+
+                arena.acquire(index)
+                self.assertIsNotNone(arena.alloc())
+                self.assertIsNone(arena.alloc())
+                arena.release(index)
+                self.assertIsNone(arena.alloc())
+                arena.release(index)
+                self.assertEqual(index, arena.alloc())
+
+                # a slot written by another process is read by this one
+                sizes = Queue()
+                p = Process(target=lambda: sizes.put(nl.load_into(id, arena.get_buffer(index))))
+                p.start()
+                node = arena.read(oft.Slot(index, sizes.get()))
+                p.join()
+                self.assertTrue(np.array_equal(nl.load_node_full_addr(id).points, node.points))
+                del node
+            finally:
+                arena.close()
+        finally:
+            shutil.rmtree("./lessOctree")
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()